@@ -1,8 +1,9 @@
 # avatar_profiles.py
 # Endpoint para exponer los JSON de avatares (ej: /avatars/sundin.json)
 
-import os, json
-from flask import Blueprint, jsonify
+import os, re, threading, time
+import orjson
+from flask import Blueprint, Response, request
 
 # 📌 Creamos el blueprint (esto es lo que importa main.py)
 bp = Blueprint("avatars", __name__, url_prefix="/avatars")
@@ -12,19 +13,127 @@ bp = Blueprint("avatars", __name__, url_prefix="/avatars")
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))  # raíz del proyecto
 BASE_DIR = os.path.join(PROJECT_ROOT, "bots", "tarjeta_inteligente")
 
+# 📌 Caché en memoria: slug -> (mtime_ns, bytes crudos del archivo)
+# El archivo ya es JSON válido: se sirve tal cual, sin parsear ni re-serializar.
+_CACHE: dict[str, tuple[int, bytes]] = {}
+_CACHE_LOCK = threading.Lock()
+
+# 📌 Caché negativa: slug inexistente -> time.monotonic() del último fallo
+_NEG: dict[str, float] = {}
+_NEG_TTL = 30.0
+_NEG_MAX = 1024
+
+CACHE_MAX_AGE = 60
+
+# 📌 Opcional: si hay nginx delante, delegarle el archivo con X-Accel-Redirect.
+# Ej: AVATARS_ACCEL_REDIRECT=/_avatars/ con
+#   location /_avatars/ { internal; alias /app/bots/tarjeta_inteligente/; }
+# Vacío (default, Render sin proxy propio) => Flask sirve desde la caché en memoria.
+AVATARS_ACCEL_REDIRECT = (os.getenv("AVATARS_ACCEL_REDIRECT") or "").strip()
+
+# 📌 Slug válido: se rechaza antes de tocar disco (evita traversal y syscalls de scanners).
+# Letras, dígitos, "_", "-" y "." (p. ej. "dr.smith"), nunca "..". El archivo se busca
+# con el slug tal cual llega.
+_SLUG_RE = re.compile(r"\A(?!.*\.\.)[A-Za-z0-9_.-]+\Z")
+
+def _json(obj, status=200):
+    return Response(orjson.dumps(obj), status=status, mimetype="application/json")
+
+def _etag_for(st) -> str:
+    # mtime + tamaño del archivo: sale del stat, sin tocar el contenido
+    return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+def _set_cache_headers(resp, st):
+    resp.set_etag(_etag_for(st))
+    resp.last_modified = st.st_mtime_ns // 1_000_000_000
+    resp.cache_control.public = True
+    resp.cache_control.max_age = CACHE_MAX_AGE
+    return resp
+
+def _json_response(raw: bytes, st):
+    """
+    Sirve los bytes cacheados con GET condicional nativo de Werkzeug
+    (If-None-Match / If-Modified-Since -> 304 sin cuerpo).
+    """
+    resp = _set_cache_headers(Response(raw, mimetype="application/json"), st)
+    return resp.make_conditional(request)
+
+def _not_found(slug: str):
+    return _json({"ok": False, "error": "Perfil no encontrado", "slug": slug}, 404)
+
+def _remember_missing(slug: str):
+    with _CACHE_LOCK:
+        if len(_NEG) > _NEG_MAX:
+            # dict conserva orden de inserción: los primeros son los más viejos
+            for old in list(_NEG)[:256]:
+                _NEG.pop(old, None)
+        _NEG[slug] = time.monotonic()
+
+def _load_into_cache(slug: str, path: str, mtime_ns: int) -> bytes:
+    with open(path, "rb") as f:
+        raw = f.read()
+    orjson.loads(raw)  # solo validamos; el cuerpo se sirve tal cual
+    with _CACHE_LOCK:
+        _CACHE[slug] = (mtime_ns, raw)
+    return raw
+
 @bp.route("/<slug>.json", methods=["GET"])
 def get_avatar(slug):
     """
     Devuelve el JSON del avatar solicitado (ej: /avatars/sundin.json)
     """
+    if not _SLUG_RE.match(slug):
+        return _not_found(slug)
+
+    if AVATARS_ACCEL_REDIRECT:
+        resp = Response(status=200, mimetype="application/json")
+        resp.headers["X-Accel-Redirect"] = f"{AVATARS_ACCEL_REDIRECT.rstrip('/')}/{slug}.json"
+        resp.cache_control.public = True
+        resp.cache_control.max_age = CACHE_MAX_AGE
+        return resp
+
+    missed_at = _NEG.get(slug)
+    if missed_at is not None and time.monotonic() - missed_at < _NEG_TTL:
+        return _not_found(slug)
+
     path = os.path.join(BASE_DIR, f"{slug}.json")
 
-    if not os.path.exists(path):
-        return jsonify({"ok": False, "error": "Perfil no encontrado", "slug": slug}), 404
+    try:
+        st = os.stat(path)
+    except OSError:
+        # inexistente, sin permiso, ruta inválida...: 404 como antes, y a la caché negativa
+        _remember_missing(slug)
+        return _not_found(slug)
+
+    # La tarjeta ya tiene esta versión: 304 antes de mirar caché o cuerpo
+    if _etag_for(st) in request.if_none_match:
+        return _set_cache_headers(Response(status=304), st)
+
+    cached = _CACHE.get(slug)
+    if cached and cached[0] == st.st_mtime_ns:
+        return _json_response(cached[1], st)
 
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return jsonify(data)
+        raw = _load_into_cache(slug, path, st.st_mtime_ns)
+        return _json_response(raw, st)
     except Exception as e:
-        return jsonify({"ok": False, "error": str(e)}), 500
+        return _json({"ok": False, "error": str(e)}, 500)
+
+# 📌 Precarga al importar el blueprint: el primer hit de cada avatar ya es un dict hit
+def _warm_cache():
+    try:
+        names = os.listdir(BASE_DIR)
+    except OSError as e:
+        print(f"[avatars] ⚠️ No se pudo precargar {BASE_DIR}: {e}")
+        return
+    for name in names:
+        slug = name[:-5]
+        if not name.endswith(".json") or not _SLUG_RE.match(slug):
+            continue
+        path = os.path.join(BASE_DIR, name)
+        try:
+            _load_into_cache(slug, path, os.stat(path).st_mtime_ns)
+        except Exception as e:
+            print(f"[avatars] ⚠️ No se pudo precargar {name}: {e}")
+
+_warm_cache()
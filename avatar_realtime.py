@@ -3,10 +3,12 @@
 # Se registra como Blueprint en main.py.
 
 import os
+import orjson
 import requests
-from flask import Blueprint, jsonify, request, make_response
-from utils.timezone_utils import hora_houston
-from utils.bot_loader import load_bot
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import Blueprint, Response, request
+from utils.bot_loader import BOTS_DIR, load_bot_versioned, system_prompt_of
 
 bp = Blueprint("realtime", __name__, url_prefix="/realtime")
 
@@ -21,88 +23,157 @@ ADVANCED_VAD_ENABLED_DEF  = os.getenv("ADVANCED_VAD_ENABLED", "0").lower() in ("
 VAD_THRESHOLD_DEFAULT     = float(os.getenv("VAD_THRESHOLD", "0.12"))
 VAD_MIN_VOICE_MS_DEFAULT  = int(os.getenv("VAD_MIN_VOICE_MS", "500"))
 
+# HTTP a OpenAI: una sola Session con pool keep-alive (evita TLS handshake por request)
+# Con el worker eventlet (monkey_patch) cada POST bloqueante solo cede su greenlet,
+# así que el pool debe alcanzar para todas las sesiones concurrentes del worker.
+OPENAI_REALTIME_SESSIONS_URL = "https://api.openai.com/v1/realtime/sessions"
+REALTIME_HTTP_POOL_MAXSIZE = int(os.getenv("REALTIME_HTTP_POOL_MAXSIZE", "64"))
+REALTIME_HTTP_TIMEOUT = (3.05, 25)  # (connect, read)
+# Reintento corto solo si la conexión no llegó a establecerse: el POST nunca salió.
+# Sin reintentos por status ni lectura: repetir el POST crearía otra sesión efímera.
+_RETRY = Retry(
+    total=2,
+    connect=2,
+    read=0,
+    status=0,
+    backoff_factor=0.2,
+)
+_HTTP = requests.Session()
+_HTTP.headers.update({
+    "Content-Type": "application/json",
+    # 👇 Este header es CLAVE para Realtime
+    "OpenAI-Beta": "realtime=v1",
+})
+_HTTP.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=REALTIME_HTTP_POOL_MAXSIZE,
+    max_retries=_RETRY,
+))
+
+# Cuerpos de error fijos serializados una sola vez
+_NO_KEY_BODY  = orjson.dumps({"ok": False, "error": "OPENAI_API_KEY no configurada"})
+_TIMEOUT_BODY = orjson.dumps({"ok": False, "error": "Timeout creando sesión"})
+_EXC_TEMPLATE = {"ok": False, "error": "Excepción creando sesión"}  # + "detail" por request
+
 # ─────────────────────────────────────────────────────────────
 # Helpers
 
+_TRUE_STRINGS = frozenset({"1", "true", "t", "yes", "y", "on"})
+
 def _to_bool(x, default=False):
     if x is None:
         return default
-    if isinstance(x, bool):
+    if x.__class__ is bool:
         return x
-    return str(x).strip().lower() in ("1", "true", "t", "yes", "y", "on")
+    return (x if isinstance(x, str) else str(x)).strip().lower() in _TRUE_STRINGS
 
 def _clamp_01(x):
     try:
         v = float(x)
     except Exception:
         return None
-    return max(0.0, min(1.0, v))
+    # Comparación encadenada: sin llamadas a max/min; NaN cae en 1.0 como antes
+    return v if 0.0 <= v <= 1.0 else (0.0 if v < 0.0 else 1.0)
+
+def _json(obj, status=200):
+    """Respuesta JSON serializada con orjson (bytes directos, sin pasar por jsonify)."""
+    return Response(orjson.dumps(obj), status=status, mimetype="application/json")
+
+def _json_bytes(body: bytes, status=200):
+    """Respuesta JSON a partir de bytes ya serializados."""
+    return Response(body, status=status, mimetype="application/json")
+
+# Origin -> headers CORS ya armados (se llena bajo demanda, acotado)
+_CORS_BUNDLES: dict[str, dict] = {}
+_CORS_BUNDLES_MAX = 256
+
+def _cors_bundle(origin: str) -> dict:
+    bundle = _CORS_BUNDLES.get(origin)
+    if bundle is None:
+        bundle = {
+            "Access-Control-Allow-Origin": origin,
+            "Vary": "Origin",
+            "Access-Control-Allow-Headers": "Content-Type, Authorization",
+            "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+            "Access-Control-Max-Age": "86400",
+        }
+        if len(_CORS_BUNDLES) >= _CORS_BUNDLES_MAX:
+            _CORS_BUNDLES.clear()
+        _CORS_BUNDLES[origin] = bundle
+    return bundle
 
 def _corsify(resp):
     """Añade CORS básicos si hay Origin (útil cuando el after_request global no aplica)."""
-    origin = request.headers.get("Origin", "")
+    origin = request.headers.get("Origin")
     if origin:
-        resp.headers["Access-Control-Allow-Origin"] = origin
-        resp.headers["Vary"] = "Origin"
-        resp.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization"
-        resp.headers["Access-Control-Allow-Methods"]  = "GET, POST, OPTIONS"
-        resp.headers["Access-Control-Max-Age"] = "86400"
+        resp.headers.update(_cors_bundle(origin))
     return resp
 
+def _preflight():
+    origin = request.headers.get("Origin")
+    return Response(status=204, headers=_cors_bundle(origin) if origin else None)
+
+# (clave de entrada, campo destino, conversión). El orden importa:
+# "silence_ms" pisa a "hold_ms" igual que antes.
+_VAD_FIELDS = (
+    ("hold_ms",      "hold_ms",   int),
+    ("silence_ms",   "hold_ms",   int),
+    ("advanced",     "advanced",  _to_bool),
+    ("threshold",    "threshold", _clamp_01),
+    ("min_voice_ms", "min_voice", int),
+)
+
+_VAD_KEYS = frozenset(key for key, _, _ in _VAD_FIELDS)
+
+# 1) Defaults/ENV
+_VAD_DEFAULT_VALS = {
+    "hold_ms":   VAD_SILENCE_MS_DEFAULT,
+    "advanced":  ADVANCED_VAD_ENABLED_DEF,
+    "threshold": VAD_THRESHOLD_DEFAULT,
+    "min_voice": VAD_MIN_VOICE_MS_DEFAULT,
+}
+
 def _effective_vad_from_request(req_json) -> dict:
-    # 1) Defaults/ENV
-    hold_ms   = VAD_SILENCE_MS_DEFAULT
-    advanced  = ADVANCED_VAD_ENABLED_DEF
-    threshold = VAD_THRESHOLD_DEFAULT
-    min_voice = VAD_MIN_VOICE_MS_DEFAULT
-
-    # 2) Query params
-    qp = request.args
-    if "hold_ms" in qp:
-        try: hold_ms = int(qp.get("hold_ms"))
-        except: pass
-    if "silence_ms" in qp:
-        try: hold_ms = int(qp.get("silence_ms"))
-        except: pass
-    if "advanced" in qp:
-        advanced = _to_bool(qp.get("advanced"), advanced)
-    if "threshold" in qp:
-        th = _clamp_01(qp.get("threshold"))
-        if th is not None: threshold = th
-    if "min_voice_ms" in qp:
-        try: min_voice = int(qp.get("min_voice_ms"))
-        except: pass
-
-    # 3) JSON body
-    vad = {}
-    if isinstance(req_json, dict):
-        vad = (req_json.get("vad") or {}) if "vad" in req_json else {}
-    if vad:
-        if "hold_ms" in vad:
-            try: hold_ms = int(vad["hold_ms"])
-            except: pass
-        if "silence_ms" in vad:
-            try: hold_ms = int(vad["silence_ms"])
-            except: pass
-        if "advanced" in vad:
-            advanced = _to_bool(vad["advanced"], advanced)
-        if "threshold" in vad:
-            th = _clamp_01(vad["threshold"])
-            if th is not None: threshold = th
-        if "min_voice_ms" in vad:
-            try: min_voice = int(vad["min_voice_ms"])
-            except: pass
-
-    # Límites razonables
-    hold_ms = int(max(200, min(15000, hold_ms)))
-    threshold = float(max(0.0, min(1.0, threshold)))
-    min_voice = int(max(0, min(3000, min_voice)))
+    body_vad = req_json.get("vad") if isinstance(req_json, dict) else None
+
+    # Camino común: ni query ni body tocan el VAD -> resultado precalculado (compartido, no mutar)
+    if not body_vad and _VAD_KEYS.isdisjoint(request.args.keys()):
+        return _DEFAULT_VAD
+
+    vals = dict(_VAD_DEFAULT_VALS)
+
+    # 2) Query params  3) JSON body (gana el último)
+    for src in (request.args, body_vad if isinstance(body_vad, dict) else {}):
+        for key, field, cast in _VAD_FIELDS:
+            raw = src.get(key)
+            if raw is None:
+                continue
+            try:
+                v = cast(raw)
+            except Exception:
+                continue
+            if v is not None:
+                vals[field] = v
+
+    return _vad_result(vals)
+
+def _vad_result(vals: dict) -> dict:
+    advanced = vals["advanced"]
+
+    # Límites razonables (threshold/min_voice solo importan con VAD avanzado)
+    hold_ms = vals["hold_ms"]
+    hold_ms = int(hold_ms if 200 <= hold_ms <= 15000 else (200 if hold_ms < 200 else 15000))
+    threshold = min_voice = None
 
     turn_detection = {
         "type": "server_vad",
         "silence_duration_ms": hold_ms
     }
     if advanced:
+        threshold = vals["threshold"]
+        threshold = float(threshold if 0.0 <= threshold <= 1.0 else (0.0 if threshold < 0.0 else 1.0))
+        min_voice = vals["min_voice"]
+        min_voice = int(min_voice if 0 <= min_voice <= 3000 else (0 if min_voice < 0 else 3000))
         # Si tu backend no soporta estos campos, OpenAI los ignora sin romper.
         turn_detection["threshold"] = threshold
         turn_detection["min_voice_ms"] = min_voice
@@ -110,46 +181,95 @@ def _effective_vad_from_request(req_json) -> dict:
     applied = {
         "advanced_enabled": advanced,
         "hold_ms": hold_ms,
-        "threshold": threshold if advanced else None,
-        "min_voice_ms": min_voice if advanced else None
+        "threshold": threshold,
+        "min_voice_ms": min_voice
     }
     return {"turn_detection": turn_detection, "applied": applied}
 
-def _system_instructions_from_bot(bot_cfg: dict) -> str:
+_DEFAULT_VAD = _vad_result(_VAD_DEFAULT_VALS)
+
+# bot_id -> (mtime_ns del JSON, plantilla de payload sin turn_detection)
+_BOT_DERIVED: dict[str, tuple[int, dict]] = {}
+
+def _realtime_payload_base(bot_id: str) -> dict:
     """
-    Soporta tus distintos formatos de JSON:
-    - { instructions: { system_prompt: "..." } }
-    - { system_prompt: "..." }
-    - { prompt: "..." }
+    Devuelve la plantilla {model, voice, modalities, instructions} del bot.
+    Se memoiza por bot_id y se invalida cuando cambia el mtime del JSON.
+    La plantilla es compartida: no mutarla, copiarla con {**base, ...}.
     """
-    if not isinstance(bot_cfg, dict):
-        return ""
-    ins = (bot_cfg.get("instructions") or {})
-    if isinstance(ins, dict) and ins.get("system_prompt"):
-        return str(ins["system_prompt"])
-    if bot_cfg.get("system_prompt"):
-        return str(bot_cfg["system_prompt"])
-    if bot_cfg.get("prompt"):
-        return str(bot_cfg["prompt"])
-    return ""
+    try:
+        mtime_ns, bot_cfg = load_bot_versioned(bot_id)
+    except Exception:
+        # fallback duro a "sundin"
+        bot_id = "sundin"
+        mtime_ns, bot_cfg = load_bot_versioned(bot_id)
+
+    if mtime_ns is not None:
+        hit = _BOT_DERIVED.get(bot_id)
+        if hit and hit[0] == mtime_ns:
+            return hit[1]
+
+    rt = bot_cfg.get("realtime") or {}
+    base = {
+        "model": rt.get("model") or REALTIME_MODEL,
+        "voice": rt.get("voice") or REALTIME_VOICE,
+        "modalities": tuple(rt.get("modalities", ["audio", "text"]) or ["audio", "text"]),
+        "instructions": system_prompt_of(bot_cfg),
+    }
+    if mtime_ns is not None:
+        _BOT_DERIVED[bot_id] = (mtime_ns, base)
+    return base
+
+# Precarga al importar: la primera /session de cada bot ya encuentra su plantilla
+def _warm_payload_templates():
+    try:
+        names = os.listdir(BOTS_DIR)
+    except OSError as e:
+        print(f"[realtime] ⚠️ No se pudo precargar {BOTS_DIR}: {e}")
+        return
+    for name in names:
+        if not name.endswith(".json") or name.startswith("_"):
+            continue
+        try:
+            _realtime_payload_base(name[:-5])
+        except Exception as e:
+            print(f"[realtime] ⚠️ No se pudo precargar {name}: {e}")
+
+_warm_payload_templates()
+
+def _openai_key_ready() -> bool:
+    """
+    Resuelve OPENAI_API_KEY una sola vez y deja el Authorization fijo en _HTTP.
+    No se lee al importar porque main.py hace load_dotenv() después de importar
+    este blueprint; mientras falte, se reintenta (lectura barata del entorno).
+    """
+    if "Authorization" in _HTTP.headers:
+        return True
+    key = os.getenv("OPENAI_API_KEY", "").strip()
+    if not key:
+        return False
+    _HTTP.headers["Authorization"] = f"Bearer {key}"
+    return True
 
 # ─────────────────────────────────────────────────────────────
 
+# /health no depende del request: se serializa una vez al importar
+_HEALTH_BODY = orjson.dumps({
+    "ok": True,
+    "service": "realtime",
+    "model": REALTIME_MODEL,
+    "voice": REALTIME_VOICE,
+    "defaults": {
+        "hold_ms": VAD_SILENCE_MS_DEFAULT,
+        "advanced_enabled": ADVANCED_VAD_ENABLED_DEF,
+        "threshold": VAD_THRESHOLD_DEFAULT if ADVANCED_VAD_ENABLED_DEF else None,
+        "min_voice_ms": VAD_MIN_VOICE_MS_DEFAULT if ADVANCED_VAD_ENABLED_DEF else None,
+    }
+})
+
 @bp.get("/health")
 def health():
-    resp = jsonify({
-        "ok": True,
-        "service": "realtime",
-        "model": REALTIME_MODEL,
-        "voice": REALTIME_VOICE,
-        "defaults": {
-            "hold_ms": VAD_SILENCE_MS_DEFAULT,
-            "advanced_enabled": ADVANCED_VAD_ENABLED_DEF,
-            "threshold": VAD_THRESHOLD_DEFAULT if ADVANCED_VAD_ENABLED_DEF else None,
-            "min_voice_ms": VAD_MIN_VOICE_MS_DEFAULT if ADVANCED_VAD_ENABLED_DEF else None,
-        }
-    })
-    return _corsify(resp)
+    return _corsify(_json_bytes(_HEALTH_BODY))
 
 @bp.route("/session", methods=["POST", "OPTIONS"])
 def create_session():
@@ -158,79 +278,59 @@ def create_session():
     Prioridad: ENV < query params < JSON body.
     """
     if request.method == "OPTIONS":
-        return _corsify(make_response(("", 204)))
-
-    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "").strip()
-    if not OPENAI_API_KEY:
-        return _corsify(jsonify({"ok": False, "error": "OPENAI_API_KEY no configurada"})), 500
+        return _preflight()
 
-    # Hora para logs si la usas
-    _ = hora_houston()
+    if not _openai_key_ready():
+        return _corsify(_json_bytes(_NO_KEY_BODY, 500))
 
     # Bot desde ?bot= / Header o fallback "sundin"
     bot_id = request.args.get("bot") or request.headers.get("X-Bot-Id") or "sundin"
-    try:
-        bot_cfg = load_bot(bot_id)
-    except Exception:
-        # fallback duro a "sundin"
-        bot_cfg = load_bot("sundin")
 
-    # Construcción robusta de instrucciones/voz/modalidades
-    instructions       = _system_instructions_from_bot(bot_cfg)
-    model_from_json    = (bot_cfg.get("realtime") or {}).get("model")
-    voice_from_json    = (bot_cfg.get("realtime") or {}).get("voice")
-    modalities_from_js = (bot_cfg.get("realtime") or {}).get("modalities", ["audio", "text"])
-
-    model_to_use      = model_from_json or REALTIME_MODEL
-    voice_to_use      = voice_from_json or REALTIME_VOICE
-    modalities_to_use = modalities_from_js or ["audio", "text"]
+    # Construcción robusta de instrucciones/voz/modalidades (plantilla memoizada por bot)
+    payload_base = _realtime_payload_base(bot_id)
 
     # VAD efectivo
-    req_json = request.get_json(silent=True) or {}
+    # orjson directo sobre el cuerpo, sin retener el buffer crudo en el request.
+    # Sin cuerpo (caso típico del navegador) no se lee ni se intenta parsear nada.
+    req_json = {}
+    if request.content_length:
+        try:
+            req_json = orjson.loads(request.get_data(cache=False)) or {}
+        except orjson.JSONDecodeError:
+            pass
     vad_cfg = _effective_vad_from_request(req_json)
     turn_detection = vad_cfg["turn_detection"]
     vad_applied    = vad_cfg["applied"]
 
-    payload = {
-        "model": model_to_use,
-        "voice": voice_to_use,
-        "modalities": modalities_to_use,
-        "instructions": instructions,
-        "turn_detection": turn_detection
-    }
+    payload = {**payload_base, "turn_detection": turn_detection}
 
     try:
-        r = requests.post(
-            "https://api.openai.com/v1/realtime/sessions",
-            headers={
-                "Authorization": f"Bearer {OPENAI_API_KEY}",
-                "Content-Type": "application/json",
-                # 👇 Este header es CLAVE para Realtime
-                "OpenAI-Beta": "realtime=v1",
-            },
-            json=payload,
-            timeout=25,
+        r = _HTTP.post(
+            OPENAI_REALTIME_SESSIONS_URL,
+            data=orjson.dumps(payload),  # Content-Type ya va fijo en _HTTP
+            timeout=REALTIME_HTTP_TIMEOUT,
         )
         if r.status_code >= 400:
             # Devolver detalle al front para depurar en la tarjeta
-            resp = jsonify({
+            resp = _json({
                 "ok": False,
                 "error": "OpenAI Realtime error",
                 "status": r.status_code,
                 "detail": r.text,
                 "payload": payload
-            })
-            return _corsify(resp), 502
+            }, 502)
+            return _corsify(resp)
 
-        data = r.json()
-        resp = jsonify({
-            "ok": True,
-            "session": data,       # incluye client_secret.value y expires_at
-            "vad_applied": vad_applied
-        })
-        return _corsify(resp)
+        # La sesión (incluye client_secret.value y expires_at) se reenvía tal cual llegó:
+        # sin decodificar y re-serializar el JSON de OpenAI.
+        raw = r.content.strip()
+        if raw[:1] != b"{":
+            # Cuerpo inesperado: que orjson lo valide (o falle) como antes
+            raw = orjson.dumps(orjson.loads(raw))
+        body = b'{"ok":true,"session":' + raw + b',"vad_applied":' + orjson.dumps(vad_applied) + b"}"
+        return _corsify(_json_bytes(body))
 
     except requests.Timeout:
-        return _corsify(jsonify({"ok": False, "error": "Timeout creando sesión"})), 504
+        return _corsify(_json_bytes(_TIMEOUT_BODY, 504))
     except Exception as e:
-        return _corsify(jsonify({"ok": False, "error": "Excepción creando sesión", "detail": str(e)})), 500
+        return _corsify(_json({**_EXC_TEMPLATE, "detail": str(e)}, 500))
@@ -5,15 +5,21 @@
 # - NUEVOS: /billing/bots (GET, POST), /billing/bots/<slug> (GET, DELETE)
 # - Página /billing/panel: tabla + modal de detalle + sección de gráficos en vivo
 
-from flask import Blueprint, request, jsonify
-from datetime import datetime, timedelta
-import os, json, glob, re
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import os, re, math, stat, string, time, threading
 import hmac, hashlib
+import logging
+import orjson
+from utils.bot_loader import list_json_entries, list_json_files
 
-from firebase_admin import db
-from twilio.rest import Client as TwilioClient
+# firebase_admin.db y twilio.rest se importan en el primer uso (_rtdb / _twilio_client):
+# importar este módulo no arrastra el SDK de Twilio ni el cliente RTDB.
 
 billing_bp = Blueprint("billing_bp", __name__)
+log = logging.getLogger("billing_api")
 
 # =======================
 # Helpers
@@ -26,8 +32,15 @@ def _bots_dir():
     os.makedirs(d, exist_ok=True)
     return d
 
+# Slug -> nombre de archivo seguro: todo lo que no sea [a-zA-Z0-9_-.] pasa a "-".
+# ASCII (caso normal) va por str.translate; el regex queda para slugs con otros caracteres.
+_SLUG_SAFE_CHARS = frozenset(string.ascii_letters + string.digits + "_-.")
+_SLUG_TRANS = {c: "-" for c in range(128) if chr(c) not in _SLUG_SAFE_CHARS}
+_SLUG_UNSAFE_RE = re.compile(r"[^a-zA-Z0-9_\-\.]")
+
 def _bot_path(slug: str):
-    safe = re.sub(r"[^a-zA-Z0-9_\-\.]", "-", (slug or "").strip())
+    raw = (slug or "").strip()
+    safe = raw.translate(_SLUG_TRANS) if raw.isascii() else _SLUG_UNSAFE_RE.sub("-", raw)
     if not safe:
         return None
     return os.path.join(_bots_dir(), f"{safe}.json")
@@ -35,27 +48,58 @@ def _bot_path(slug: str):
 def _read_json(path):
     if not os.path.isfile(path):
         return None
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    with open(path, "rb") as f:
+        return orjson.loads(f.read())
+
+# BOTS_DURABLE=1 => fsync del .tmp antes del os.replace (sobrevive a un corte de luz).
+# Por defecto se confía en el page cache, como hasta ahora.
+BOTS_DURABLE = os.getenv("BOTS_DURABLE", "0").strip().lower() in ("1", "true", "yes", "on")
 
 def _write_json(path, data):
+    # Mismo formato que json.dump(indent=2, ensure_ascii=False), serializado por orjson
+    buf = memoryview(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
     tmp = path + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        while buf:
+            buf = buf[os.write(fd, buf):]
+        if BOTS_DURABLE:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
     os.replace(tmp, path)
 
 def _utcdate(s: str):
-    return datetime.strptime(s, "%Y-%m-%d").date()
+    try:
+        return date.fromisoformat(s)  # YYYY-MM-DD: camino rápido en C
+    except ValueError:
+        # strptime acepta también días/meses sin cero ("2024-1-5") y da el mismo error si no parsea
+        return datetime.strptime(s, "%Y-%m-%d").date()
+
+# Periodo actual "YYYY-MM": solo cambia una vez al mes, se recalcula cada 60 s.
+# (expira monotonic, valor) en una sola tupla: la asignación es atómica y la carrera es benigna.
+_PYM_CACHE = (0.0, "")
 
 def _period_ym(dt=None):
-    dt = dt or datetime.utcnow()
-    return dt.strftime("%Y-%m")
+    global _PYM_CACHE
+    if dt is not None:
+        return f"{dt.year:04d}-{dt.month:02d}"
+    exp, val = _PYM_CACHE
+    now = time.monotonic()
+    if now < exp:
+        return val
+    d = datetime.utcnow()
+    val = f"{d.year:04d}-{d.month:02d}"
+    _PYM_CACHE = (now + 60.0, val)
+    return val
 
 def _daterange(d1, d2):
-    cur = d1
-    while cur <= d2:
-        yield cur
-        cur += timedelta(days=1)
+    """Lista de datetime.date entre d1 y d2 inclusive; vacía si d2 < d1."""
+    return [d1 + timedelta(days=i) for i in range((d2 - d1).days + 1)]
+
+def _ymd_range(d1, d2):
+    """Igual que _daterange pero ya como "YYYY-MM-DD" (isoformat, sin strftime por día)."""
+    return [d.isoformat() for d in _daterange(d1, d2)]
 
 def _as_float(x, default=0.0):
     try:
@@ -63,14 +107,113 @@ def _as_float(x, default=0.0):
     except Exception:
         return float(default)
 
+def _as_int(x, default=0):
+    # Contadores de RTDB: int casi siempre; datos viejos o editados a mano pueden traer "12" o 12.0
+    if x.__class__ is int:
+        return x
+    try:
+        return int(x or 0)
+    except (TypeError, ValueError):
+        try:
+            return int(float(x))
+        except (TypeError, ValueError):
+            return int(default)
+
+# RTDB (OpenAI) y Twilio son independientes: /usage y /usage_ts los consultan en paralelo.
+# Con eventlet (monkey_patch) estos hilos son greenlets: el respaldo de /clients lanza 3 lecturas por bot.
+_IO_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("BILLING_IO_WORKERS", "32")),
+                              thread_name_prefix="billing-io")
+
+# ETag / 304 para el panel (hace polling de /bots y /clients)
+def _etag_of(*parts) -> str:
+    return hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=16).hexdigest()
+
+def _not_modified(etag: str):
+    """Respuesta 304 si el cliente ya tiene esta versión; None si hay que armar el cuerpo."""
+    if etag in request.if_none_match:
+        resp = Response(status=304)
+        resp.set_etag(etag)
+        return resp
+    return None
+
+def _bots_sig(bots: dict):
+    # Firma del dict devuelto por load_bots_folder; si otro hilo ya lo reemplazó,
+    # un valor irrepetible (ETag que nunca vuelve a coincidir) en vez de una firma ajena.
+    cached = _BOTS_CACHE
+    return cached["sig"] if cached["data"] is bots else time.monotonic_ns()
+
+def _json_bytes(obj):
+    # Cuerpos grandes (/bots, /clients, /usage): orjson directo a bytes, sin pasar por
+    # el provider de Flask (que devuelve str y luego se vuelve a codificar)
+    return Response(orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS), mimetype="application/json")
+
+def _with_etag(resp, etag: str):
+    resp.set_etag(etag)
+    return resp
+
 # =======================
 # Bots loader (desde ./bots/*.json)
 # =======================
+# Último resultado de load_bots_folder + firma de ./bots/*.json (nombre, mtime, tamaño).
+# La firma cambia con el CRUD (tmp + os.replace) y también con ediciones in-place desde
+# VSCode, que no tocan el mtime del directorio. Se reemplaza entero (asignación atómica).
+_BOTS_CACHE = {"sig": None, "data": {}, "by_lname": {}, "by_key": {}, "by_name": {},
+               "by_number": {}, "by_any_number": {}, "client_rows": []}
+# Durante BOTS_CACHE_TTL segundos ni siquiera se re-escanea la carpeta (ráfagas del panel).
+# El CRUD de este proceso invalida al momento; ediciones externas se ven tras el TTL.
+BOTS_CACHE_TTL = float(os.getenv("BOTS_CACHE_TTL", "2"))
+_BOTS_FRESH_UNTIL = 0.0
+# Un solo re-parseo a la vez: si el panel dispara varias peticiones justo tras un cambio,
+# las demás esperan y reutilizan el dict recién construido.
+_BOTS_LOCK = threading.Lock()
+
+def _invalidate_bots_cache():
+    global _BOTS_FRESH_UNTIL
+    _BOTS_FRESH_UNTIL = 0.0
+
+def _scan_bot_files():
+    paths, sig = [], []
+    try:
+        entries = list_json_entries(_bots_dir())
+    except OSError:
+        return (), paths  # carpeta inexistente: sin bots, como glob
+    for e in entries:
+        try:
+            st = e.stat()
+        except OSError:
+            continue  # borrado (DELETE, guardado tmp+rename) entre el listado y el stat
+        paths.append(e.path)
+        sig.append((e.name, st.st_mtime_ns, st.st_size))
+    return tuple(sorted(sig)), paths
+
 def load_bots_folder():
+    """
+    Dict slug -> cfg de ./bots/*.json. Mientras ningún archivo cambie se devuelve
+    el mismo dict (un stat por archivo, sin abrir ni parsear): no mutarlo.
+    """
+    global _BOTS_FRESH_UNTIL
+    now = time.monotonic()
+    cached = _BOTS_CACHE
+    if now < _BOTS_FRESH_UNTIL:
+        return cached["data"]
+    sig, paths = _scan_bot_files()
+    if cached["sig"] == sig:
+        _BOTS_FRESH_UNTIL = now + BOTS_CACHE_TTL
+        return cached["data"]
+    with _BOTS_LOCK:
+        cached = _BOTS_CACHE
+        if cached["sig"] == sig:
+            return cached["data"]
+        return _parse_bot_files(sig, paths, now)
+
+def _parse_bot_files(sig, paths, now):
+    # Llamar con _BOTS_LOCK tomado
+    global _BOTS_CACHE, _BOTS_FRESH_UNTIL
     bots = {}
-    for path in glob.glob(os.path.join(_bots_dir(), "*.json")):
+    for path in paths:
         try:
-            data = _read_json(path)
+            with open(path, "rb") as f:
+                data = orjson.loads(f.read())
             if isinstance(data, dict):
                 if "slug" in data:
                     bots[data["slug"]] = data
@@ -80,17 +223,57 @@ def load_bots_folder():
                             v.setdefault("slug", k)
                             bots[k] = v
         except Exception as e:
-            print(f"[billing_api] ⚠️ No se pudo cargar {path}: {e}")
+            log.warning("[billing_api] ⚠️ No se pudo cargar %s: %s", path, e)
+    # Índices (gana el primero, como los escaneos lineales que reemplazan):
+    # nombre en minúsculas -> nombre canónico; nombre o slug en minúsculas -> cfg;
+    # nombre sin espacios en minúsculas -> cfg (webhook); E.164 -> cfg
+    by_lname, by_key, by_name = {}, {}, {}
+    by_number, by_any_number = {}, {}
+    for cfg in bots.values():
+        name = cfg.get("name")
+        if isinstance(name, str) and name:
+            by_lname.setdefault(name.lower(), name)
+        for k in (name, cfg.get("slug")):
+            if isinstance(k, str):
+                by_key.setdefault(k.lower(), cfg)
+        lname = str(cfg.get("name", "")).strip().lower()
+        if lname:
+            by_name.setdefault(lname, cfg)
+        for key in ("twilio_number", "whatsapp_number"):
+            _, n = _normalize_number(cfg.get(key) or "")
+            if n:
+                by_number.setdefault(n, cfg)
+    for cfg in bots.values():
+        for n in _all_e164_numbers_from_cfg(cfg):
+            by_any_number.setdefault(n, cfg)
+    client_rows = [_client_row(cfg, name) for cfg in bots.values() if (name := _client_bot_name(cfg))]
+    _BOTS_CACHE = {"sig": sig, "data": bots, "by_lname": by_lname, "by_key": by_key,
+                   "by_name": by_name, "by_number": by_number, "by_any_number": by_any_number,
+                   "client_rows": client_rows}
+    _BOTS_FRESH_UNTIL = now + BOTS_CACHE_TTL
     return bots
 
 def _normalize_bot_name(bots_config: dict, name: str):
     if not name:
         return None
+    cached = _BOTS_CACHE
+    if bots_config is cached["data"]:
+        return cached["by_lname"].get(str(name).lower())
     for cfg in bots_config.values():
         if isinstance(cfg, dict) and cfg.get("name", "").lower() == str(name).lower():
             return cfg.get("name")
     return None
 
+def _find_bot_cfg(bots_config: dict, bot: str):
+    """cfg cuyo name o slug coincide con bot (sin distinguir mayúsculas), o None."""
+    cached = _BOTS_CACHE
+    if bots_config is cached["data"]:
+        return cached["by_key"].get(bot.lower())
+    for cfg in bots_config.values():
+        if cfg.get("name", "").lower() == bot.lower() or cfg.get("slug","").lower()==bot.lower():
+            return cfg
+    return None
+
 def _first_bot_name():
     bots = load_bots_folder()
     if not bots:
@@ -102,104 +285,229 @@ def _first_bot_name():
 # =======================
 # RTDB paths
 # =======================
+@lru_cache(maxsize=1)
+def _rtdb():
+    from firebase_admin import db
+    return db
+
+@lru_cache(maxsize=4096)
+def _ref(path: str):
+    # Reference es inmutable y thread-safe: se reutiliza por ruta
+    return _rtdb().reference(path)
+
 def _status_ref(bot_name: str):
-    return db.reference(f"billing/status/{bot_name}")
+    return _ref(f"billing/status/{bot_name}")
 
 def _consumption_ref(bot_name: str, period_ym: str):
-    return db.reference(f"billing/consumption/{bot_name}/{period_ym}")
+    return _ref(f"billing/consumption/{bot_name}/{period_ym}")
 
 def _rates_ref(bot_name: str):
-    return db.reference(f"billing/rates/{bot_name}")
+    return _ref(f"billing/rates/{bot_name}")
 
 def _service_item_ref(bot_name: str):
-    return db.reference(f"billing/service_item/{bot_name}")
+    return _ref(f"billing/service_item/{bot_name}")
 
 def _openai_day_ref(bot_name: str, ymd: str):
-    return db.reference(f"billing/openai/{bot_name}/{ymd}/aggregate")
+    return _ref(f"billing/openai/{bot_name}/{ymd}/aggregate")
+
+# Snapshots de nodos padre (billing/status, billing/consumption, billing/service_item)
+# para endpoints que recorren todos los bots: 1 round-trip por nodo en vez de N.
+# TTL corto; las escrituras de este proceso invalidan su nodo al momento.
+_SNAPSHOT_TTL = 5.0
+_SNAPSHOTS = {}  # nodo -> (expira monotonic, dict, digest del contenido)
+
+def _billing_snapshot_versioned(node: str):
+    """(dict, digest) del nodo; el digest solo cambia si cambia el contenido (sirve de ETag)."""
+    now = time.monotonic()
+    hit = _SNAPSHOTS.get(node)
+    if hit and now < hit[0]:
+        return hit[1], hit[2]
+    data = _ref(f"billing/{node}").get()
+    if not isinstance(data, dict):
+        data = {}
+    digest = hashlib.blake2b(orjson.dumps(data, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS),
+                             digest_size=8).hexdigest()
+    _SNAPSHOTS[node] = (now + _SNAPSHOT_TTL, data, digest)
+    return data, digest
+
+def _billing_snapshot(node: str) -> dict:
+    return _billing_snapshot_versioned(node)[0]
+
+def _invalidate_snapshot(node: str):
+    _SNAPSHOTS.pop(node, None)
+
+# Lecturas puntuales (status / service_item / consumo de un bot) con TTL corto:
+# /toggle, /consumption, /service-item y /usage repiten las mismas rutas en ráfagas.
+# Clave = el Reference (único por ruta gracias a _ref); las escrituras de este proceso lo invalidan.
+BILLING_POINT_TTL = float(os.getenv("BILLING_POINT_TTL", "10"))
+_POINT_CACHE_MAX = 4096
+_POINT_CACHE = {}  # Reference -> (expira monotonic, valor)
+
+def _cached_get(ref):
+    now = time.monotonic()
+    hit = _POINT_CACHE.get(ref)
+    if hit and now < hit[0]:
+        return hit[1]
+    val = ref.get()
+    if len(_POINT_CACHE) >= _POINT_CACHE_MAX:
+        _POINT_CACHE.clear()
+    _POINT_CACHE[ref] = (now + BILLING_POINT_TTL, val)
+    return val
+
+def _invalidate_point(ref):
+    _POINT_CACHE.pop(ref, None)
 
 # =======================
 # ON/OFF
 # =======================
+def _status_str(val) -> str:
+    if isinstance(val, bool):
+        return "on" if val else "off"
+    if isinstance(val, str):
+        return "on" if val.lower() == "on" else "off"
+    return "off"
+
 def _get_status(bot_name: str) -> str:
     try:
-        val = _status_ref(bot_name).get()
-        if isinstance(val, bool):
-            return "on" if val else "off"
-        if isinstance(val, str):
-            return "on" if val.lower() == "on" else "off"
-        return "off"
+        return _status_str(_cached_get(_status_ref(bot_name)))
     except Exception as e:
-        print(f"[billing_api] ⚠️ Error leyendo status: {e}")
+        log.warning("[billing_api] ⚠️ Error leyendo status: %s", e)
         return "off"
 
 def _set_status(bot_name: str, state: str):
     try:
-        _status_ref(bot_name).set(True if state == "on" else False)
+        ref = _status_ref(bot_name)
+        ref.set(True if state == "on" else False)
+        _invalidate_point(ref)
+        _invalidate_snapshot("status")
         return True
     except Exception as e:
-        print(f"[billing_api] ❌ Error guardando status: {e}")
+        log.error("[billing_api] ❌ Error guardando status: %s", e)
         return False
 
 # =======================
 # OpenAI usage (aggregate y serie)
 # =======================
+def _sv_increment(n: int):
+    # ServerValue.increment de RTDB vía REST: suma atómica en el servidor, sin leer antes
+    return {".sv": {"increment": n}}
+
 def record_openai_usage(bot: str, model: str, input_tokens: int, output_tokens: int):
     if not bot:
         return
-    today = datetime.utcnow().strftime("%Y-%m-%d")
-    ref = _openai_day_ref(bot, today)
-    cur = ref.get() or {}
-    cur["total_input_tokens"]  = int(cur.get("total_input_tokens", 0)) + int(input_tokens or 0)
-    cur["total_output_tokens"] = int(cur.get("total_output_tokens", 0)) + int(output_tokens or 0)
-    cur["total_requests"]      = int(cur.get("total_requests", 0)) + 1
-
+    today = datetime.utcnow().date().isoformat()
+    itok = int(input_tokens or 0)
+    otok = int(output_tokens or 0)
     m = (model or "unknown")
-    model_counts = cur.get("model_counts", {})
-    info = model_counts.get(m, {"requests":0,"input_tokens":0,"output_tokens":0})
-    info["requests"]      += 1
-    info["input_tokens"]  += int(input_tokens or 0)
-    info["output_tokens"] += int(output_tokens or 0)
-    model_counts[m] = info
-    cur["model_counts"] = model_counts
-    ref.set(cur)
+    # Un solo PATCH multi-ruta con incrementos atómicos: sin carrera entre /track/openai
+    # concurrentes y sin bajar/subir el model_counts completo en cada llamada.
+    _openai_day_ref(bot, today).update({
+        "total_input_tokens":  _sv_increment(itok),
+        "total_output_tokens": _sv_increment(otok),
+        "total_requests":      _sv_increment(1),
+        f"model_counts/{m}/requests":      _sv_increment(1),
+        f"model_counts/{m}/input_tokens":  _sv_increment(itok),
+        f"model_counts/{m}/output_tokens": _sv_increment(otok),
+    })
+
+# Tarifas por bot: casi nunca cambian, se memoizan 60 s (el panel hace polling de /usage)
+_RATES_TTL = 60.0
+_RATES_CACHE = {}  # bot -> (expira monotonic, (rate_in, rate_out))
+_RATES_LOCK = threading.Lock()
 
 def _get_openai_rates(bot: str):
+    now = time.monotonic()
+    hit = _RATES_CACHE.get(bot)
+    if hit and now < hit[0]:
+        return hit[1]
     bot_rates = _rates_ref(bot).get() or {}
-    return (
+    rates = (
         _as_float(bot_rates.get("openai_input_per_1k", os.getenv("OAI_INPUT_PER_1K", "0.00"))),
         _as_float(bot_rates.get("openai_output_per_1k", os.getenv("OAI_OUTPUT_PER_1K", "0.00")))
     )
+    with _RATES_LOCK:
+        _RATES_CACHE[bot] = (now + _RATES_TTL, rates)
+    return rates
 
-def _sum_openai(bot: str, d1: str, d2: str):
+def _invalidate_rates_cache(bot: str):
+    with _RATES_LOCK:
+        _RATES_CACHE.pop(bot, None)
+
+def _openai_days(bot: str, d1: str, d2: str):
+    """Itera (ymd, aggregate) de cada día del rango; {} en días sin datos."""
     start, end = _utcdate(d1), _utcdate(d2)
+    # Un solo query por rango de claves (YYYY-MM-DD ordena igual que la fecha) en vez de un get por día
+    days = (_ref(f"billing/openai/{bot}").order_by_key()
+            .start_at(start.isoformat()).end_at(end.isoformat()).get())
+    if not isinstance(days, dict):
+        days = {}
+    for ymd in _ymd_range(start, end):
+        day = days.get(ymd)
+        yield ymd, (day.get("aggregate") if isinstance(day, dict) else None) or {}
+
+# Costos en micro-dólares enteros (1e-6 USD): sumas exactas y un solo paso a float al final
+def _micros(usd: float) -> int:
+    return int(round(usd * 1_000_000))
+
+# Tarifas por 1k tokens en nano-dólares (1e-9 USD): 0.0000375/1k queda exacta (37500)
+# en vez de redondearse a 38 micro-USD; solo se redondea el costo final
+def _nanos(usd: float) -> int:
+    return int(round(usd * 1_000_000_000))
+
+def _token_cost_micros(tok_in: int, tok_out: int, rin_n: int, rout_n: int) -> int:
+    # tokens × (nano-USD por 1k tokens) / 1000 / 1000, redondeado al micro-USD
+    return (tok_in * rin_n + tok_out * rout_n + 500_000) // 1_000_000
+
+def _openai_day_row(ymd: str, node: dict, rin_n: int, rout_n: int, with_cost: bool = True) -> dict:
+    di  = _as_int(node.get("total_input_tokens"))
+    do  = _as_int(node.get("total_output_tokens"))
+    dr  = _as_int(node.get("total_requests"))
+    return {
+        "date": ymd,
+        "input_tokens": di,
+        "output_tokens": do,
+        "requests": dr,
+        "cost_estimate_usd": _token_cost_micros(di, do, rin_n, rout_n) / 1_000_000 if with_cost else 0.0
+    }
+
+# A partir de este número de días el costo por día se calcula vectorizado con NumPy
+# (se importa ahí: arrancar el worker no paga el import de numpy)
+_NUMPY_MIN_DAYS = 30
+
+def _sum_openai(bot: str, d1: str, d2: str):
     t_in = t_out = t_req = 0
     model_counts = {}
     per_day = []
     rate_in, rate_out = _get_openai_rates(bot)
+    rin_n, rout_n = _nanos(rate_in), _nanos(rate_out)
+
+    for ymd, node in _openai_days(bot, d1, d2):
+        per_day.append(_openai_day_row(ymd, node, rin_n, rout_n, with_cost=False))
+        for m, info in (node.get("model_counts") or {}).items():
+            acc = model_counts.get(m)
+            if acc is None:
+                acc = model_counts[m] = {"requests":0,"input_tokens":0,"output_tokens":0}
+            acc["requests"]      += _as_int(info.get("requests"))
+            acc["input_tokens"]  += _as_int(info.get("input_tokens"))
+            acc["output_tokens"] += _as_int(info.get("output_tokens"))
+
+    n = len(per_day)
+    if n >= _NUMPY_MIN_DAYS:
+        import numpy as np
+        ins  = np.fromiter((r["input_tokens"] for r in per_day), dtype=np.int64, count=n)
+        outs = np.fromiter((r["output_tokens"] for r in per_day), dtype=np.int64, count=n)
+        reqs = np.fromiter((r["requests"] for r in per_day), dtype=np.int64, count=n)
+        costs = ((ins * rin_n + outs * rout_n + 500_000) // 1_000_000 / 1_000_000).tolist()
+        for row, cost in zip(per_day, costs):
+            row["cost_estimate_usd"] = cost
+        t_in, t_out, t_req = int(ins.sum()), int(outs.sum()), int(reqs.sum())
+    else:
+        for row in per_day:
+            di, do = row["input_tokens"], row["output_tokens"]
+            row["cost_estimate_usd"] = _token_cost_micros(di, do, rin_n, rout_n) / 1_000_000
+            t_in += di; t_out += do; t_req += row["requests"]
 
-    for d in _daterange(start, end):
-        ymd = d.strftime("%Y-%m-%d")
-        node = _openai_day_ref(bot, ymd).get() or {}
-        di  = int(node.get("total_input_tokens", 0))
-        do  = int(node.get("total_output_tokens", 0))
-        dr  = int(node.get("total_requests", 0))
-        cost = (di/1000.0)*rate_in + (do/1000.0)*rate_out
-        per_day.append({
-            "date": ymd,
-            "input_tokens": di,
-            "output_tokens": do,
-            "requests": dr,
-            "cost_estimate_usd": round(cost, 6)
-        })
-        t_in  += di; t_out += do; t_req += dr
-        for m, info in (node.get("model_counts", {}) or {}).items():
-            acc = model_counts.get(m, {"requests":0,"input_tokens":0,"output_tokens":0})
-            acc["requests"]      += int(info.get("requests", 0))
-            acc["input_tokens"]  += int(info.get("input_tokens", 0))
-            acc["output_tokens"] += int(info.get("output_tokens", 0))
-            model_counts[m] = acc
-
-    total_cost = (t_in/1000.0)*rate_in + (t_out/1000.0)*rate_out
+    total_cost = _token_cost_micros(t_in, t_out, rin_n, rout_n) / 1_000_000
     return {
         "requests": t_req,
         "input_tokens": t_in,
@@ -214,16 +522,37 @@ def _sum_openai(bot: str, d1: str, d2: str):
 # =======================
 # Twilio usage (aggregate y serie)
 # =======================
+# Un solo cliente Twilio por proceso (y por credenciales): reutiliza su pool keep-alive
+# en vez de abrir sesión + TLS nuevos en cada /usage.
+_TWILIO = {"key": None, "client": None}
+_TWILIO_LOCK = threading.Lock()
+
 def _twilio_client():
     sid = os.getenv("TWILIO_ACCOUNT_SID", "").strip()
     tok = os.getenv("TWILIO_AUTH_TOKEN", "").strip()
     if not sid or not tok:
         return None
-    return TwilioClient(sid, tok)
+    key = (sid, tok)
+    if _TWILIO["key"] == key:
+        return _TWILIO["client"]
+    with _TWILIO_LOCK:
+        if _TWILIO["key"] != key:
+            from twilio.rest import Client as TwilioClient
+            from twilio.http.http_client import TwilioHttpClient
+            from requests.adapters import HTTPAdapter
+            http = TwilioHttpClient(pool_connections=True, timeout=30)
+            http.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=20))
+            _TWILIO["client"] = TwilioClient(sid, tok, http_client=http)
+            _TWILIO["key"] = key
+    return _TWILIO["client"]
 
 def _get_bot_twilio_number(cfg: dict) -> str:
     return (cfg.get("twilio_number") or cfg.get("whatsapp_number") or "").strip()
 
+def _twilio_from_filter(from_number: str) -> dict:
+    # Filtro From en la API de Twilio: solo se paginan los mensajes del número del bot
+    return {"from_": from_number} if from_number else {}
+
 def _twilio_sum_prices(bot_cfg: dict, start: str, end: str, from_number_override: str = ""):
     client = _twilio_client()
     res = {"messages": 0, "price_usd": 0.0, "note": "Basado en Message.price; algunos mensajes pueden tardar en reflejar precio definitivo."}
@@ -235,32 +564,31 @@ def _twilio_sum_prices(bot_cfg: dict, start: str, end: str, from_number_override
     if not from_number:
         from_number = _get_bot_twilio_number(bot_cfg)
 
-    d1 = datetime.strptime(start, "%Y-%m-%d")
-    d2 = datetime.strptime(end, "%Y-%m-%d") + timedelta(days=1)
+    d1 = datetime.combine(_utcdate(start), datetime.min.time())
+    d2 = datetime.combine(_utcdate(end), datetime.min.time()) + timedelta(days=1)
 
     total_msgs = 0
-    total_price = 0.0
+    total_micros = 0
     try:
-        msgs = client.messages.list(date_sent_after=d1, date_sent_before=d2)
+        msgs = client.messages.stream(date_sent_after=d1, date_sent_before=d2, page_size=1000,
+                                      **_twilio_from_filter(from_number))
         for m in msgs:
-            if from_number and (str(m.from_) or "").strip() != from_number:
-                continue
             total_msgs += 1
             if m.price and m.price_unit == "USD":
-                total_price += _as_float(m.price, 0.0)
+                total_micros += _micros(_as_float(m.price, 0.0))
     except Exception as e:
-        print(f"[billing_api] ⚠️ Error Twilio list: {e}")
+        log.warning("[billing_api] ⚠️ Error Twilio list: %s", e)
         res["note"] = "Error consultando Twilio (revisa SID/TOKEN y rango)."
 
     res["messages"] = total_msgs
-    res["price_usd"] = round(total_price, 4)
+    res["price_usd"] = round(total_micros / 1_000_000, 4)
     return res
 
 def _twilio_series(bot_cfg: dict, start: str, end: str, from_number_override: str = ""):
     client = _twilio_client()
     per_day = []
     total_msgs = 0
-    total_price = 0.0
+    total_micros = 0
     note = "Basado en Message.price; algunos mensajes pueden tardar en reflejar precio definitivo."
 
     if not client:
@@ -271,33 +599,39 @@ def _twilio_series(bot_cfg: dict, start: str, end: str, from_number_override: st
         from_number = _get_bot_twilio_number(bot_cfg)
 
     s, e = _utcdate(start), _utcdate(end)
+    # Una sola consulta para todo el rango; se reparte por día en memoria.
+    # stream() pagina de forma perezosa: no arma la lista completa como list().
+    buckets = {ymd: [0, 0] for ymd in _ymd_range(s, e)}  # ymd -> [mensajes, costo en micro-USD]
     try:
-        for day in _daterange(s, e):
-            d1 = datetime(day.year, day.month, day.day)
-            d2 = d1 + timedelta(days=1)
-            msgs = client.messages.list(date_sent_after=d1, date_sent_before=d2)
-            cnt = 0
-            cost = 0.0
-            for m in msgs:
-                if from_number and (str(m.from_) or "").strip() != from_number:
-                    continue
-                cnt += 1
-                if m.price and m.price_unit == "USD":
-                    cost += _as_float(m.price, 0.0)
-            per_day.append({"date": day.strftime("%Y-%m-%d"), "messages": cnt, "price_usd": round(cost, 6)})
-            total_msgs += cnt
-            total_price += cost
+        d1 = datetime(s.year, s.month, s.day)
+        d2 = datetime(e.year, e.month, e.day) + timedelta(days=1)
+        for m in client.messages.stream(date_sent_after=d1, date_sent_before=d2, page_size=1000,
+                                        **_twilio_from_filter(from_number)):
+            b = buckets.get(m.date_sent.date().isoformat()) if m.date_sent else None
+            if b is None:
+                continue
+            b[0] += 1
+            if m.price and m.price_unit == "USD":
+                b[1] += _micros(_as_float(m.price, 0.0))
     except Exception as e:
-        print(f"[billing_api] ⚠️ Error Twilio series: {e}")
+        log.warning("[billing_api] ⚠️ Error Twilio series: %s", e)
         note = "Error consultando Twilio (revisa SID/TOKEN y rango)."
 
-    return {"per_day": per_day, "messages": total_msgs, "price_usd": round(total_price, 4), "note": note}
+    for ymd, (cnt, cost_m) in buckets.items():
+        per_day.append({"date": ymd, "messages": cnt, "price_usd": cost_m / 1_000_000})
+        total_msgs += cnt
+        total_micros += cost_m
+
+    return {"per_day": per_day, "messages": total_msgs, "price_usd": round(total_micros / 1_000_000, 4), "note": note}
 
 # =======================
 # Ítem fijo de servicio
 # =======================
 def _get_service_item(bot: str):
-    n = _service_item_ref(bot).get() or {}
+    return _service_item_from(_cached_get(_service_item_ref(bot)))
+
+def _service_item_from(n):
+    n = n if isinstance(n, dict) else {}
     return {
         "enabled": bool(n.get("enabled", True)),
         "amount":  _as_float(n.get("amount", os.getenv("SERVICE_ITEM_AMOUNT", "200.0"))),
@@ -306,7 +640,10 @@ def _get_service_item(bot: str):
 
 def _set_service_item(bot: str, enabled: bool, amount: float, label: str):
     payload = {"enabled": bool(enabled), "amount": float(amount), "label": (label or "").strip() or "Servicio"}
-    _service_item_ref(bot).set(payload)
+    ref = _service_item_ref(bot)
+    ref.set(payload)
+    _invalidate_point(ref)
+    _invalidate_snapshot("service_item")
     return payload
 
 # =======================
@@ -314,8 +651,13 @@ def _set_service_item(bot: str, enabled: bool, amount: float, label: str):
 # =======================
 @billing_bp.route("/bots", methods=["GET"])
 def bots_list():
+    bots = load_bots_folder()
+    etag = _etag_of("bots", _bots_sig(bots))
+    hit = _not_modified(etag)
+    if hit is not None:
+        return hit
     data = []
-    for slug, cfg in load_bots_folder().items():
+    for slug, cfg in bots.items():
         item = {
             "slug": slug,
             "name": cfg.get("name", slug),
@@ -329,19 +671,30 @@ def bots_list():
             "greeting": cfg.get("greeting", ""),
         }
         data.append(item)
-    return jsonify({"success": True, "data": data})
+    return _with_etag(_json_bytes({"success": True, "data": data}), etag)
 
 @billing_bp.route("/bots/<slug>", methods=["GET"])
 def bots_get(slug):
     p = _bot_path(slug)
-    if not p or not os.path.isfile(p):
+    try:
+        st = os.stat(p) if p else None
+    except OSError:
+        st = None
+    if st is None or not stat.S_ISREG(st.st_mode):
         return jsonify({"success": False, "message": "No encontrado"}), 404
+    etag = _etag_of("bot", slug, st.st_mtime_ns, st.st_size)
+    hit = _not_modified(etag)
+    if hit is not None:
+        return hit
     data = _read_json(p)
+    if data is None:
+        # borrado entre el stat y la lectura
+        return jsonify({"success": False, "message": "No encontrado"}), 404
     if "slug" not in data:
         only = list(data.values())[0]
         only["slug"] = slug
         data = only
-    return jsonify({"success": True, "data": data})
+    return _with_etag(jsonify({"success": True, "data": data}), etag)
 
 @billing_bp.route("/bots/<slug>", methods=["DELETE"])
 def bots_delete(slug):
@@ -349,6 +702,7 @@ def bots_delete(slug):
     if not p or not os.path.isfile(p):
         return jsonify({"success": False, "message": "No encontrado"}), 404
     os.remove(p)
+    _invalidate_bots_cache()
     return jsonify({"success": True})
 
 @billing_bp.route("/bots", methods=["POST"])
@@ -371,6 +725,7 @@ def bots_upsert():
     }
     path = _bot_path(slug)
     _write_json(path, payload)
+    _invalidate_bots_cache()
     return jsonify({"success": True, "data": payload})
 
 # =======================
@@ -384,31 +739,94 @@ def health():
 def list_clients():
     bots_config = load_bots_folder()
     period = request.args.get("period") or _period_ym()
-    items = []
-    for cfg in bots_config.values():
-        if not isinstance(cfg, dict):
-            continue
-        bot_name = cfg.get("name") or cfg.get("slug") or ""
-        if not bot_name:
-            continue
-        business_name = cfg.get("business_name", bot_name)
-        email = cfg.get("email") or (cfg.get("contact", {}) or {}).get("email") or ""
-        phone = cfg.get("phone") or (cfg.get("contact", {}) or {}).get("phone") or ""
-        val = _consumption_ref(bot_name, period).get()
-        consumo_cents = int((val or {}).get("cents", 0) if isinstance(val, dict) else (val or 0))
-        status = _get_status(bot_name)
-        svc = _get_service_item(bot_name)
-        items.append({
-            "id": bot_name,
-            "name": business_name,
-            "email": email,
-            "phone": phone,
-            "consumo_cents": consumo_cents,
-            "consumo_period": period,
-            "bot_status": status,
-            "service_item": svc,
-        })
-    return jsonify({"success": True, "data": items})
+    # Un get por nodo padre para todos los bots (en vez de 3 por bot), los tres en paralelo
+    try:
+        f_status = _IO_POOL.submit(_billing_snapshot_versioned, "status")
+        f_svc = _IO_POOL.submit(_billing_snapshot_versioned, "service_item")
+        consumption_all, d_cons = _billing_snapshot_versioned("consumption")
+        status_all, d_status = f_status.result()
+        svc_all, d_svc = f_svc.result()
+    except Exception as e:
+        # Respaldo (p. ej. reglas RTDB que no dejan leer el nodo padre): lecturas por bot en paralelo
+        log.warning("[billing_api] ⚠️ Snapshot de billing no disponible, leyendo por bot: %s", e)
+        return _json_bytes({"success": True, "data": _client_items_point_reads(bots_config, period)})
+
+    etag = _etag_of("clients", _bots_sig(bots_config), period, d_status, d_cons, d_svc)
+    hit = _not_modified(etag)
+    if hit is not None:
+        return hit
+    # Filas estáticas precalculadas al parsear ./bots; aquí solo se cruzan con los snapshots
+    items = [{
+        "id": bot_name,
+        "name": business_name,
+        "email": email,
+        "phone": phone,
+        "consumo_cents": _consumo_cents(_period_val(consumption_all, bot_name, period)),
+        "consumo_period": period,
+        "bot_status": _status_str(status_all.get(bot_name)),
+        "service_item": _service_item_from(svc_all.get(bot_name)),
+    } for bot_name, business_name, email, phone in _client_rows(bots_config)]
+    return _with_etag(_json_bytes({"success": True, "data": items}), etag)
+
+def _client_bot_name(cfg) -> str:
+    if not isinstance(cfg, dict):
+        return ""
+    return cfg.get("name") or cfg.get("slug") or ""
+
+def _client_row(cfg: dict, bot_name: str):
+    """Parte estática de cada fila de /clients: (id, name, email, phone)."""
+    business_name = cfg.get("business_name", bot_name)
+    email = cfg.get("email") or (cfg.get("contact", {}) or {}).get("email") or ""
+    phone = cfg.get("phone") or (cfg.get("contact", {}) or {}).get("phone") or ""
+    return bot_name, business_name, email, phone
+
+def _client_rows(bots_config: dict):
+    cached = _BOTS_CACHE
+    if bots_config is cached["data"]:
+        return cached["client_rows"]
+    return [_client_row(cfg, name) for cfg in bots_config.values() if (name := _client_bot_name(cfg))]
+
+def _period_val(consumption_all: dict, bot_name: str, period: str):
+    per_bot = consumption_all.get(bot_name)
+    return per_bot.get(period) if isinstance(per_bot, dict) else None
+
+def _consumo_cents(val) -> int:
+    return int((val or {}).get("cents", 0) if isinstance(val, dict) else (val or 0))
+
+def _client_item(cfg: dict, bot_name: str, period: str, consumption_val, status_val, svc_val) -> dict:
+    bot_name, business_name, email, phone = _client_row(cfg, bot_name)
+    return {
+        "id": bot_name,
+        "name": business_name,
+        "email": email,
+        "phone": phone,
+        "consumo_cents": _consumo_cents(consumption_val),
+        "consumo_period": period,
+        "bot_status": _status_str(status_val),
+        "service_item": _service_item_from(svc_val),
+    }
+
+def _status_val_or_none(bot_name: str):
+    try:
+        return _status_ref(bot_name).get()
+    except Exception as e:
+        log.warning("[billing_api] ⚠️ Error leyendo status: %s", e)
+        return None
+
+def _client_items_point_reads(bots_config: dict, period: str) -> list:
+    """
+    Lecturas por bot cuando no hay snapshot: las 3 de cada bot (consumo, status, ítem)
+    van todas a la vez al pool y se re-emparejan por posición; tarda ~1 RTT en vez de 3N.
+    """
+    named = [(cfg, _client_bot_name(cfg)) for cfg in bots_config.values()]
+    named = [(cfg, name) for cfg, name in named if name]
+    futs = [(cfg, name,
+             _IO_POOL.submit(lambda n=name: _consumption_ref(n, period).get()),
+             _IO_POOL.submit(_status_val_or_none, name),
+             _IO_POOL.submit(lambda n=name: _service_item_ref(n).get()))
+            for cfg, name in named]
+    return [_client_item(cfg, name, period, f_cons.result(), f_status.result(), f_svc.result())
+            for cfg, name, f_cons, f_status, f_svc in futs]
 
 @billing_bp.route("/toggle", methods=["POST"])
 def toggle_bot():
@@ -429,7 +847,7 @@ def get_consumption(bot_name):
     period = request.args.get("period") or _period_ym()
     bots_config = load_bots_folder()
     bot_norm = _normalize_bot_name(bots_config, bot_name) or bot_name
-    val = _consumption_ref(bot_norm, period).get()
+    val = _cached_get(_consumption_ref(bot_norm, period))
     cents = int((val or {}).get("cents", 0) if isinstance(val, dict) else (val or 0))
     return jsonify({"success": True, "bot": bot_norm, "period": period, "consumo_cents": cents})
 
@@ -446,6 +864,43 @@ def service_item(bot):
     saved = _set_service_item(bot_norm, enabled, amount, label)
     return jsonify({"success": True, "service_item": saved})
 
+@billing_bp.route("/rates/<bot>", methods=["GET", "POST"])
+def openai_rates(bot):
+    bots_config = load_bots_folder()
+    bot_norm = _normalize_bot_name(bots_config, bot) or bot
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        upd = {}
+        for key in ("openai_input_per_1k", "openai_output_per_1k"):
+            if key in data:
+                v = _as_float(data.get(key), 0.0)
+                if not (math.isfinite(v) and v >= 0):
+                    return jsonify({"success": False, "message": f"{key} inválido (número >= 0)"}), 400
+                upd[key] = v
+        if not upd:
+            return jsonify({"success": False, "message": "openai_input_per_1k u openai_output_per_1k requerido"}), 400
+        _rates_ref(bot_norm).update(upd)
+        _invalidate_rates_cache(bot_norm)
+        _invalidate_usage_ts_cache(bot_norm)
+    rate_in, rate_out = _get_openai_rates(bot_norm)
+    return jsonify({"success": True, "bot": bot_norm,
+                    "openai_input_per_1k": rate_in, "openai_output_per_1k": rate_out})
+
+# Tope de días por consulta de uso (cada día es trabajo en RTDB/Twilio)
+BILLING_MAX_RANGE_DAYS = int(os.getenv("BILLING_MAX_RANGE_DAYS", "400"))
+
+def _range_error(start: str, end: str):
+    """Mensaje de error si el rango no es válido; None si se puede consultar."""
+    try:
+        d1, d2 = _utcdate(start), _utcdate(end)
+    except ValueError:
+        return "start y end deben ser fechas YYYY-MM-DD"
+    if d2 < d1:
+        return "end no puede ser anterior a start"
+    if (d2 - d1).days > BILLING_MAX_RANGE_DAYS:
+        return f"rango máximo {BILLING_MAX_RANGE_DAYS} días"
+    return None
+
 @billing_bp.route("/usage/<bot>", methods=["GET"])
 def usage(bot):
     start = (request.args.get("start") or "").strip()
@@ -453,17 +908,18 @@ def usage(bot):
     from_number = (request.args.get("from_number") or "").strip()
     if not start or not end:
         return jsonify({"success": False, "message": "start y end son requeridos (YYYY-MM-DD)"}), 400
-    bots_config = load_bots_folder()
-    bot_cfg = None
-    bot_name = None
-    for cfg in bots_config.values():
-        if cfg.get("name", "").lower() == bot.lower() or cfg.get("slug","").lower()==bot.lower():
-            bot_cfg = cfg; bot_name = cfg.get("name") or cfg.get("slug"); break
+    bad = _range_error(start, end)
+    if bad:
+        return jsonify({"success": False, "message": bad}), 400
+    bot_cfg = _find_bot_cfg(load_bots_folder(), bot)
+    bot_name = (bot_cfg.get("name") or bot_cfg.get("slug")) if bot_cfg else None
     if not bot_name:
         bot_name = bot; bot_cfg = {}
+    f_tw = _IO_POOL.submit(_twilio_sum_prices, bot_cfg, start, end, from_number_override=from_number)
+    f_svc = _IO_POOL.submit(_get_service_item, bot_name)
     oa = _sum_openai(bot_name, start, end)
-    tw = _twilio_sum_prices(bot_cfg, start, end, from_number_override=from_number)
-    svc = _get_service_item(bot_name)
+    tw = f_tw.result()
+    svc = f_svc.result()
     subtotal = oa.get("cost_estimate_usd", 0.0) + tw.get("price_usd", 0.0)
     total = subtotal + (svc["amount"] if svc["enabled"] else 0.0)
     payload = {
@@ -475,7 +931,41 @@ def usage(bot):
         "subtotal_usd": round(subtotal, 4),
         "total_usd": round(total, 4)
     }
-    return jsonify(payload)
+    return _json_bytes(payload)
+
+# /usage_ts ya serializado: el panel repite la misma consulta cada pocos segundos y los
+# días pasados no cambian. Si el rango incluye hoy el TTL es más corto (RTDB/Twilio siguen sumando).
+USAGE_TS_CACHE_TTL = float(os.getenv("USAGE_TS_CACHE_TTL", "30"))
+USAGE_TS_CACHE_TTL_TODAY = float(os.getenv("USAGE_TS_CACHE_TTL_TODAY", "15"))
+_USAGE_TS_CACHE_MAX = 256
+_USAGE_TS_CACHE = {}  # (bot, start, end, from_number) -> (expira monotonic, bytes, etag)
+_USAGE_TS_LOCK = threading.Lock()
+
+def _usage_ts_cached(key):
+    hit = _USAGE_TS_CACHE.get(key)
+    if hit and time.monotonic() < hit[0]:
+        return hit
+    return None
+
+def _usage_ts_store(key, end: str, body: bytes):
+    ttl = USAGE_TS_CACHE_TTL_TODAY if end >= datetime.utcnow().date().isoformat() else USAGE_TS_CACHE_TTL
+    hit = (time.monotonic() + ttl, body, hashlib.blake2b(body, digest_size=16).hexdigest())
+    if ttl > 0:
+        with _USAGE_TS_LOCK:
+            if len(_USAGE_TS_CACHE) >= _USAGE_TS_CACHE_MAX:
+                # dict conserva orden de inserción: fuera los más viejos
+                for old in list(_USAGE_TS_CACHE)[:_USAGE_TS_CACHE_MAX // 4]:
+                    _USAGE_TS_CACHE.pop(old, None)
+            _USAGE_TS_CACHE[key] = hit
+    return hit
+
+def _usage_ts_response(hit):
+    return _not_modified(hit[2]) or _with_etag(Response(hit[1], mimetype="application/json"), hit[2])
+
+def _invalidate_usage_ts_cache(bot: str):
+    with _USAGE_TS_LOCK:
+        for key in [k for k in _USAGE_TS_CACHE if k[0] == bot]:
+            _USAGE_TS_CACHE.pop(key, None)
 
 @billing_bp.route("/usage_ts/<bot>", methods=["GET"])
 def usage_ts(bot):
@@ -484,17 +974,21 @@ def usage_ts(bot):
     from_number = (request.args.get("from_number") or "").strip()
     if not start or not end:
         return jsonify({"success": False, "message": "start y end son requeridos (YYYY-MM-DD)"}), 400
-    bots_config = load_bots_folder()
-    bot_cfg = None
-    bot_name = None
-    for cfg in bots_config.values():
-        if cfg.get("name", "").lower() == bot.lower() or cfg.get("slug","").lower()==bot.lower():
-            bot_cfg = cfg; bot_name = cfg.get("name") or cfg.get("slug"); break
+    bad = _range_error(start, end)
+    if bad:
+        return jsonify({"success": False, "message": bad}), 400
+    bot_cfg = _find_bot_cfg(load_bots_folder(), bot)
+    bot_name = (bot_cfg.get("name") or bot_cfg.get("slug")) if bot_cfg else None
     if not bot_name:
         bot_name = bot; bot_cfg = {}
+    key = (bot_name, start, end, from_number)
+    hit = _usage_ts_cached(key)
+    if hit:
+        return _usage_ts_response(hit)
+    f_tw = _IO_POOL.submit(_twilio_series, bot_cfg, start, end, from_number_override=from_number)
     oa_all = _sum_openai(bot_name, start, end)
-    tw_all = _twilio_series(bot_cfg, start, end, from_number_override=from_number)
-    return jsonify({
+    tw_all = f_tw.result()
+    body = orjson.dumps({
         "success": True,
         "bot": bot_name,
         "range": {"start": start, "end": end},
@@ -514,6 +1008,57 @@ def usage_ts(bot):
             "per_day": tw_all["per_day"]
         }
     })
+    return _usage_ts_response(_usage_ts_store(key, end, body))
+
+@billing_bp.route("/usage_ts_stream/<bot>", methods=["GET"])
+def usage_ts_stream(bot):
+    """
+    Variante NDJSON de /usage_ts para rangos largos: una línea por día a medida que se
+    calcula (primero OpenAI, luego Twilio) y una línea final con los totales.
+    /usage_ts queda igual para los consumidores actuales.
+    """
+    start = (request.args.get("start") or "").strip()
+    end   = (request.args.get("end") or "").strip()
+    from_number = (request.args.get("from_number") or "").strip()
+    if not start or not end:
+        return jsonify({"success": False, "message": "start y end son requeridos (YYYY-MM-DD)"}), 400
+    bad = _range_error(start, end)
+    if bad:
+        return jsonify({"success": False, "message": bad}), 400
+    bot_cfg = _find_bot_cfg(load_bots_folder(), bot)
+    bot_name = (bot_cfg.get("name") or bot_cfg.get("slug")) if bot_cfg else None
+    if not bot_name:
+        bot_name = bot; bot_cfg = {}
+    f_tw = _IO_POOL.submit(_twilio_series, bot_cfg, start, end, from_number_override=from_number)
+
+    def _line(obj):
+        return orjson.dumps(obj) + b"\n"
+
+    def generate():
+        rate_in, rate_out = _get_openai_rates(bot_name)
+        rin_n, rout_n = _nanos(rate_in), _nanos(rate_out)
+        yield _line({"type": "meta", "bot": bot_name, "range": {"start": start, "end": end},
+                     "rate_input_per_1k": rate_in, "rate_output_per_1k": rate_out})
+        t_in = t_out = t_req = 0
+        for ymd, node in _openai_days(bot_name, start, end):
+            row = _openai_day_row(ymd, node, rin_n, rout_n)
+            t_in += row["input_tokens"]; t_out += row["output_tokens"]; t_req += row["requests"]
+            yield _line({"type": "openai", **row})
+        tw_all = f_tw.result()
+        for row in tw_all["per_day"]:
+            yield _line({"type": "twilio", **row})
+        yield _line({
+            "type": "totals",
+            "openai": {
+                "requests": t_req,
+                "input_tokens": t_in,
+                "output_tokens": t_out,
+                "cost_estimate_usd": round(_token_cost_micros(t_in, t_out, rin_n, rout_n) / 1_000_000, 4),
+            },
+            "twilio": {"messages": tw_all["messages"], "price_usd": tw_all["price_usd"], "note": tw_all["note"]},
+        })
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
 
 @billing_bp.route("/invoice/<bot>", methods=["GET"])
 def invoice(bot):
@@ -534,12 +1079,18 @@ def track_openai():
 # =======================
 # Email & Webhook ElevenLabs
 # =======================
-import smtplib, ssl
+import smtplib, ssl, queue, tempfile
 from email.message import EmailMessage
-from urllib.request import urlopen
-from urllib.error import URLError, HTTPError
+import requests
+from requests.adapters import HTTPAdapter
+
+# Descargas de grabaciones: keep-alive hacia el CDN de ElevenLabs en vez de TCP+TLS por llamada
+_DOWNLOAD_HTTP = requests.Session()
+_DOWNLOAD_HTTP.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=32))
 
+@lru_cache(maxsize=1)
 def _smtp_settings():
+    # Se lee en el primer correo (ya con .env cargado) y queda fijo; no mutar el dict
     return {
         "host": os.getenv("SMTP_HOST", "").strip(),
         "port": int(os.getenv("SMTP_PORT", "587").strip() or "587"),
@@ -553,10 +1104,8 @@ def _send_email(subject: str, body_text: str, attachments: list = None, to_addrs
     cfg = _smtp_settings()
     final_to = to_addrs if (to_addrs and len(to_addrs)>0) else cfg["to_addrs"]
     if not (cfg["host"] and cfg["from_addr"] and final_to):
-        print("[email] ⚠️ SMTP no configurado o sin destinatarios. Solo log.")
-        print("[email] Asunto:", subject)
-        print("[email] Para:", final_to or "(vacío)")
-        print("[email] Texto:\n", body_text)
+        log.warning("[email] ⚠️ SMTP no configurado o sin destinatarios. Solo log.")
+        log.info("[email] Asunto: %s | Para: %s\n%s", subject, final_to or "(vacío)", body_text)
         return False
 
     msg = EmailMessage()
@@ -573,32 +1122,96 @@ def _send_email(subject: str, body_text: str, attachments: list = None, to_addrs
                                subtype=(att.get("mime","application/octet-stream").split("/")[1]),
                                filename=att.get("filename","file.bin"))
         except Exception as e:
-            print(f"[email] ⚠️ No se pudo adjuntar {att.get('filename')}: {e}")
+            log.warning("[email] ⚠️ No se pudo adjuntar %s: %s", att.get("filename"), e)
 
-    context = ssl.create_default_context()
     try:
-        with smtplib.SMTP(cfg["host"], cfg["port"]) as server:
-            server.starttls(context=context)
-            if cfg["user"]:
-                server.login(cfg["user"], cfg["password"])
-            server.send_message(msg)
-        print("[email] ✉️ Enviado OK a:", final_to)
+        _smtp_send(cfg, msg)
+        log.info("[email] ✉️ Enviado OK a: %s", final_to)
         return True
     except Exception as e:
-        print("[email] ❌ Error SMTP:", e)
+        log.error("[email] ❌ Error SMTP: %s", e)
         return False
 
+# Conexiones SMTP ya autenticadas (STARTTLS + LOGIN son ~la mitad del costo de cada correo).
+# Se devuelven al pool tras un envío OK; ante cualquier error la conexión se descarta.
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", str(min(16, (os.cpu_count() or 1) * 2))))
+_SMTP_POOL = queue.LifoQueue(maxsize=SMTP_POOL_SIZE)  # LIFO: la más reciente es la más probable viva
+
+def _smtp_key(cfg: dict):
+    return (cfg["host"], cfg["port"], cfg["user"], cfg["password"])
+
+def _smtp_connect(cfg: dict):
+    server = smtplib.SMTP(cfg["host"], cfg["port"], timeout=30)
+    try:
+        server.starttls(context=ssl.create_default_context())
+        if cfg["user"]:
+            server.login(cfg["user"], cfg["password"])
+    except Exception:
+        server.close()
+        raise
+    return server
+
+def _smtp_release(key, server):
+    try:
+        _SMTP_POOL.put_nowait((key, server))
+    except queue.Full:
+        _smtp_discard(server)
+
+def _smtp_discard(server):
+    try:
+        server.quit()
+    except Exception:
+        server.close()
+
+def _smtp_send(cfg: dict, msg):
+    key = _smtp_key(cfg)
+    while True:
+        try:
+            pooled_key, server = _SMTP_POOL.get_nowait()
+        except queue.Empty:
+            break
+        if pooled_key != key:
+            _smtp_discard(server)  # credenciales cambiaron
+            continue
+        try:
+            server.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            server.close()  # el servidor cerró la conexión ociosa: probar con otra / una nueva
+            continue
+        except Exception:
+            _smtp_discard(server)
+            raise
+        _smtp_release(key, server)
+        return
+    server = _smtp_connect(cfg)
+    try:
+        server.send_message(msg)
+    except Exception:
+        _smtp_discard(server)
+        raise
+    _smtp_release(key, server)
+
 def _download_file(url: str, timeout: int = 15):
+    # Por bloques a un SpooledTemporaryFile (pasa a disco desde 4 MB): una WAV larga no
+    # queda a la vez como lista de chunks y como bytes unidos (r.content)
     try:
-        with urlopen(url, timeout=timeout) as r:
-            data = r.read()
-            ct = r.info().get_content_type() or "application/octet-stream"
-            return data, ct
-    except (URLError, HTTPError) as e:
-        print("[download] ⚠️ Error descargando", url, e)
+        with _DOWNLOAD_HTTP.get(url, timeout=timeout, stream=True) as r:
+            r.raise_for_status()
+            ct = (r.headers.get("Content-Type") or "").split(";", 1)[0].strip().lower()
+            with tempfile.SpooledTemporaryFile(max_size=4 * 1024 * 1024) as buf:
+                for chunk in r.iter_content(chunk_size=64 * 1024):
+                    buf.write(chunk)
+                buf.seek(0)
+                return buf.read(), ct or "application/octet-stream"
+    except requests.RequestException as e:
+        log.warning("[download] ⚠️ Error descargando %s %s", url, e)
         return None, None
 
 # ====== NUEVO: Normalización y matching por número ======
+# Precompilados: _normalize_number corre por cada teléfono de cada bot al resolver el webhook
+_NUM_STRIP_RE = re.compile(r'[\s\-\(\)]')
+_NUM_DIGITS_RE = re.compile(r'^\d{8,15}$')
+
 def _normalize_number(value: str):
     """
     Devuelve (proto, numE164) donde proto ∈ {'tel','whatsapp'} y numE164 comienza con '+'.
@@ -611,8 +1224,8 @@ def _normalize_number(value: str):
     if v.lower().startswith('whatsapp:'):
         proto = 'whatsapp'
         v = v[len('whatsapp:'):]
-    v = re.sub(r'[\s\-\(\)]', '', v)
-    if not v.startswith('+') and re.match(r'^\d{8,15}$', v):
+    v = _NUM_STRIP_RE.sub('', v)
+    if not v.startswith('+') and _NUM_DIGITS_RE.match(v):
         v = '+' + v
     return (proto, v)
 
@@ -698,6 +1311,10 @@ def _match_bot_by_number_e164(bots: dict, num_e164: str):
     if not num_e164:
         return None
 
+    cached = _BOTS_CACHE
+    if bots is cached["data"]:
+        return cached["by_number"].get(num_e164) or cached["by_any_number"].get(num_e164)
+
     # 1) Preferir match en claves explícitas
     for cfg in bots.values():
         for key in ("twilio_number","whatsapp_number"):
@@ -713,6 +1330,15 @@ def _match_bot_by_number_e164(bots: dict, num_e164: str):
 
     return None
 
+_STRICT_SLUG_KEYS = ("bot_slug","agent_slug","slug","bot","agent","assistant")
+
+# Resolución por identidad del evento (números llamados + campos de slug): los reintentos
+# de ElevenLabs repiten el mismo payload, y eleven_post_call resuelve dos veces si no hay bot.
+# Se descarta entera si cambia ./bots (firma de load_bots_folder).
+_RESOLVE_TTL = 60.0
+_RESOLVE_MAX = 256
+_RESOLVE_CACHE = {"sig": None, "map": {}}  # clave -> (expira monotonic, cfg o None)
+
 def _resolve_bot_strict(payload: dict):
     """
     Estricto:
@@ -720,18 +1346,34 @@ def _resolve_bot_strict(payload: dict):
     2) Si no hay número, intentar por slug EXACTO
     3) Si no se resuelve, devolver None (NO adivinar por nombre)
     """
+    global _RESOLVE_CACHE
     bots = load_bots_folder()
     if not bots:
         return None
 
+    nums = _extract_called_numbers(payload)
+    sig = _bots_sig(bots)
+    cache = _RESOLVE_CACHE
+    if cache["sig"] != sig or len(cache["map"]) >= _RESOLVE_MAX:
+        cache = _RESOLVE_CACHE = {"sig": sig, "map": {}}
+    key = (tuple(nums), tuple((payload.get(k) or "").strip() for k in _STRICT_SLUG_KEYS))
+    now = time.monotonic()
+    hit = cache["map"].get(key)
+    if hit and now < hit[0]:
+        return hit[1]
+    cfg = _resolve_bot_uncached(bots, payload, nums)
+    cache["map"][key] = (now + _RESOLVE_TTL, cfg)
+    return cfg
+
+def _resolve_bot_uncached(bots: dict, payload: dict, nums: list):
     # 1) match por número
-    for num in _extract_called_numbers(payload):
+    for num in nums:
         cfg = _match_bot_by_number_e164(bots, num)
         if cfg:
             return cfg
 
     # 2) slug exacto
-    for key in ("bot_slug","agent_slug","slug","bot","agent","assistant"):
+    for key in _STRICT_SLUG_KEYS:
         val = (payload.get(key) or "").strip()
         if val and val in bots:
             return bots[val]
@@ -764,47 +1406,57 @@ def _find_bot_cfg_for_payload(payload: dict) -> dict:
         for key in ("bot","agent","agent_number","to","twilio_to","number","recipient_number"):
             v = (extra.get(key) or "").strip()
             if v: candidates.append(v)
+    # Una sola pasada: gana el primer candidato que sea slug exacto; si ninguno lo es,
+    # el primero que coincida por nombre (mismo orden de prioridad que antes)
+    cached = _BOTS_CACHE
+    by_name = cached["by_name"] if bots is cached["data"] else None
+    name_hit = None
     for cand in candidates:
-        if cand in bots:
-            return bots[cand]
-    for cand in candidates:
-        for cfg in bots.values():
-            if str(cfg.get("name","")).strip().lower() == cand.strip().lower():
-                return cfg
-    to_v = (payload.get("to") or "").strip()
-    if to_v and to_v in bots:
-        return bots[to_v]
+        cfg = bots.get(cand)
+        if cfg is not None:
+            return cfg
+        if name_hit is None:
+            if by_name is not None:
+                name_hit = by_name.get(cand.lower())
+            else:
+                lc = cand.lower()
+                name_hit = next((c for c in bots.values()
+                                 if str(c.get("name","")).strip().lower() == lc), None)
+    if name_hit is not None:
+        return name_hit
+    # ("to" ya está entre los candidatos: si fuera slug habría salido arriba)
     for cfg in bots.values():
         return cfg
     return {}
 
 # ====== Resolución de destinatarios por BOT ======
 def _extract_emails_from_cfg(cfg: dict) -> list:
-    emails = []
+    # Primera fuente con algún correo: notify.emails > emails > contact.email
     notify = cfg.get("notify") or {}
     if isinstance(notify, dict):
         arr = notify.get("emails")
         if isinstance(arr, list):
-            emails.extend([e for e in arr if isinstance(e, str) and e.strip()])
-    if not emails:
-        arr2 = cfg.get("emails")
-        if isinstance(arr2, list):
-            emails.extend([e for e in arr2 if isinstance(e, str) and e.strip()])
-    if not emails:
-        contact = cfg.get("contact") or {}
-        if isinstance(contact, dict):
-            ce = contact.get("email")
-            if isinstance(ce, str) and ce.strip():
-                emails.append(ce.strip())
-    return [e.strip() for e in emails if e and isinstance(e, str)]
+            emails = [e.strip() for e in arr if isinstance(e, str) and e.strip()]
+            if emails:
+                return emails
+    arr2 = cfg.get("emails")
+    if isinstance(arr2, list):
+        emails = [e.strip() for e in arr2 if isinstance(e, str) and e.strip()]
+        if emails:
+            return emails
+    contact = cfg.get("contact") or {}
+    if isinstance(contact, dict):
+        ce = contact.get("email")
+        if isinstance(ce, str) and ce.strip():
+            return [ce.strip()]
+    return []
 
 def _bot_emails_for_event(payload: dict, cfg_resuelto: dict = None) -> list:
     cfg = cfg_resuelto or _resolve_bot_strict(payload)
     emails = _extract_emails_from_cfg(cfg) if cfg else []
     if emails:
         return emails
-    env_to = [a.strip() for a in (os.getenv("EMAIL_TO","").split(",") if os.getenv("EMAIL_TO") else []) if a.strip()]
-    return env_to
+    return list(_smtp_settings()["to_addrs"])
 
 # ====== Verificación opcional de firma HMAC de Eleven ======
 def _verify_eleven_signature(req) -> bool:
@@ -813,13 +1465,17 @@ def _verify_eleven_signature(req) -> bool:
         return True
     sig = req.headers.get("ElevenLabs-Signature") or req.headers.get("X-ElevenLabs-Signature") or ""
     if not sig:
-        print("[eleven_webhook] ⚠️ Falta header de firma.")
+        log.warning("[eleven_webhook] ⚠️ Falta header de firma.")
         return True
     body = req.get_data() or b""
-    digest = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
-    ok = hmac.compare_digest(sig.strip(), digest.strip()) or hmac.compare_digest(sig.replace("sha256=","").strip(), digest.strip())
-    if not ok:
-        print("[eleven_webhook] ⚠️ Firma HMAC no coincide. Header:", sig, " Calculada:", digest)
+    # hmac.digest: una llamada a OpenSSL, sin objeto HMAC; se comparan los 32 bytes, no el hex
+    mac = hmac.digest(secret.encode("utf-8"), body, "sha256")
+    try:
+        given = bytes.fromhex(sig.replace("sha256=", "").strip())
+    except ValueError:
+        given = b""
+    if not hmac.compare_digest(given, mac):
+        log.warning("[eleven_webhook] ⚠️ Firma HMAC no coincide. Header: %s  Calculada: %s", sig, mac.hex())
     return True
 
 # ====== Render bonito de conversación (HTML + texto)
@@ -854,10 +1510,10 @@ def _build_branded_email(agent_name, agent_phone, transcript_list):
     header_txt = []
     if agent_name:  header_txt.append(f"Agente: {agent_name}")
     if agent_phone: header_txt.append(f"Número: {agent_phone}")
-    conv_txt, _ = _render_transcript_blocks(transcript_list)
+    # Un solo recorrido del transcript arma el texto plano y los bloques HTML
+    conv_txt, conv_blocks = _render_transcript_blocks(transcript_list)
     text_plain = "\n".join(header_txt + ["", conv_txt])
 
-    _, conv_blocks = _render_transcript_blocks(transcript_list)
     html = f"""
     <div style="background:{_BRAND_BG};padding:24px;font-family:ui-sans-serif,system-ui,-apple-system,Segoe UI,Roboto,Ubuntu,Arial;color:#e5e7eb;">
       <div style="max-width:760px;margin:0 auto;">
@@ -878,7 +1534,7 @@ def eleven_post_call():
     _verify_eleven_signature(request)
 
     payload = request.get_json(silent=True) or {}
-    print("[eleven_webhook] payload:", payload)
+    log.debug("[eleven_webhook] payload: %s", payload)
 
     data = payload.get("data") or {}
     transcript_list = data.get("transcript") or payload.get("transcript") or []
@@ -905,11 +1561,10 @@ def eleven_post_call():
         agent_name = "UNRESOLVED"
         agent_number_display = agent_phone_number or ""
 
-    # Adjuntos: primer audio (opcional)
+    # Adjuntos: primer audio (opcional); se descarga en segundo plano
     recs = payload.get("recordings") or payload.get("recording_urls") or data.get("recordings") or []
     if isinstance(recs, str):
         recs = [recs]
-    attachments = []
     first_audio = None
     if isinstance(recs, list) and recs:
         first = recs[0]
@@ -917,30 +1572,165 @@ def eleven_post_call():
             first_audio = first.get("url") or first.get("href")
         elif isinstance(first, str):
             first_audio = first
-    if first_audio:
-        data_bytes, mime = _download_file(first_audio)
-        if data_bytes:
-            ext = "mp3"
-            if "wav" in (mime or "") or str(first_audio).endswith(".wav"):
-                ext = "wav"
-            attachments.append({
-                "filename": f"call_recording.{ext}",
-                "content": data_bytes,
-                "mime": mime or "audio/mpeg"
-            })
 
     recipients = _bot_emails_for_event(payload, cfg_resuelto=cfg_guess)
-    print("[eleven_webhook] Destinatarios:", recipients or "(vacío)")
-
-    text_plain, html_body = _build_branded_email(agent_name, agent_number_display, transcript_list)
+    log.info("[eleven_webhook] Destinatarios: %s", recipients or "(vacío)")
 
     caller_number = ( (data.get("metadata") or {}).get("phone_call") or {} ).get("external_number") \
                     or (payload.get("caller") or payload.get("from") or payload.get("phone") or (payload.get("call") or {}).get("from") or "")
     subj = f"[Post-Call] {business_name} – {caller_number or 'desconocido'}"
 
-    _send_email(subj, text_plain, attachments, to_addrs=recipients, html_body=html_body)
+    # Sin SMTP o sin destinatarios _send_email solo registraría el correo: no se arma
+    # el cuerpo ni se descarga la grabación
+    smtp = _smtp_settings()
+    if not (smtp["host"] and smtp["from_addr"] and recipients):
+        log.warning("[eleven_webhook] ⚠️ SMTP no configurado o sin destinatarios; se omite el correo: %s", subj)
+        return jsonify({"ok": True, "skipped": "no recipients"})
+
+    text_plain, html_body = _build_branded_email(agent_name, agent_number_display, transcript_list)
+
+    # Descarga + SMTP fuera del request: ElevenLabs recibe el 200 al momento. El trabajo
+    # va primero al spool, así un reinicio con la cola llena no lo pierde.
+    job = {"subject": subj, "text": text_plain, "html": html_body,
+           "to": recipients, "audio_url": first_audio}
+    _submit_post_call(job, _spool_post_call(job))
     return jsonify({"ok": True})
 
+# =======================
+# Post-call en segundo plano
+# =======================
+_POST_CALL_EXEC = ThreadPoolExecutor(max_workers=int(os.getenv("POST_CALL_WORKERS", "8")),
+                                     thread_name_prefix="post-call")
+# Cada trabajo se guarda en el spool (un JSON) antes de encolarse y se borra al enviarse.
+# Los que fallan se reintentan desde las peticiones, como mucho cada POST_CALL_REPLAY_EVERY_S;
+# tras N intentos o pasada la edad máxima van a failed/.
+POST_CALL_SPOOL_DIR = os.getenv("POST_CALL_SPOOL_DIR", "").strip() or _here("data", "post_call_spool")
+POST_CALL_MAX_ATTEMPTS = int(os.getenv("POST_CALL_MAX_ATTEMPTS", "5"))
+POST_CALL_MAX_AGE_S = float(os.getenv("POST_CALL_MAX_AGE_HOURS", "72")) * 3600
+POST_CALL_REPLAY_EVERY_S = float(os.getenv("POST_CALL_REPLAY_EVERY_S", "300"))
+
+# Rutas del spool ya encoladas en _POST_CALL_EXEC: el replay no las vuelve a encolar
+_POST_CALL_INFLIGHT = set()
+_POST_CALL_INFLIGHT_LOCK = threading.Lock()
+
+def _recording_attachment(url: str):
+    data_bytes, mime = _download_file(url)
+    if not data_bytes:
+        return None
+    ext = "mp3"
+    if "wav" in (mime or "") or str(url).endswith(".wav"):
+        ext = "wav"
+    return {
+        "filename": f"call_recording.{ext}",
+        "content": data_bytes,
+        "mime": mime or "audio/mpeg"
+    }
+
+def _submit_post_call(job: dict, spool_path: str = None):
+    if spool_path:
+        with _POST_CALL_INFLIGHT_LOCK:
+            if spool_path in _POST_CALL_INFLIGHT:
+                return
+            _POST_CALL_INFLIGHT.add(spool_path)
+    _POST_CALL_EXEC.submit(_process_post_call, job, spool_path)
+
+def _process_post_call(job: dict, spool_path: str = None):
+    try:
+        ok = False
+        try:
+            attachments = []
+            if job.get("audio_url"):
+                att = _recording_attachment(job["audio_url"])
+                if att:
+                    attachments.append(att)
+            ok = _send_email(job["subject"], job["text"], attachments, to_addrs=job["to"], html_body=job["html"])
+        except Exception as e:
+            log.error("[eleven_webhook] ❌ Error procesando post-call: %s", e)
+
+        if ok:
+            if spool_path:
+                try:
+                    os.remove(spool_path)
+                except OSError:
+                    pass
+            return
+
+        job["attempts"] = int(job.get("attempts") or 0) + 1
+        if not spool_path:
+            _spool_post_call(job)  # no se pudo guardar antes de encolar: segundo intento
+        elif job["attempts"] >= POST_CALL_MAX_ATTEMPTS:
+            _quarantine_post_call(spool_path, f"{job['attempts']} intentos")
+        else:
+            try:
+                _write_json(spool_path, job)
+            except Exception as e:
+                log.error("[eleven_webhook] ❌ No se pudo actualizar post-call pendiente %s: %s", spool_path, e)
+    finally:
+        if spool_path:
+            with _POST_CALL_INFLIGHT_LOCK:
+                _POST_CALL_INFLIGHT.discard(spool_path)
+
+def _spool_post_call(job: dict):
+    """Guarda el trabajo en el spool; devuelve la ruta o None si no se pudo escribir."""
+    try:
+        os.makedirs(POST_CALL_SPOOL_DIR, exist_ok=True)
+        job.setdefault("created", time.time())
+        path = os.path.join(POST_CALL_SPOOL_DIR, f"{time.time_ns()}-{threading.get_ident()}.json")
+        _write_json(path, job)
+        return path
+    except Exception as e:
+        log.error("[eleven_webhook] ❌ No se pudo guardar post-call pendiente: %s", e)
+        return None
+
+def _quarantine_post_call(path: str, reason: str):
+    qdir = os.path.join(POST_CALL_SPOOL_DIR, "failed")
+    try:
+        os.makedirs(qdir, exist_ok=True)
+        os.replace(path, os.path.join(qdir, os.path.basename(path)))
+        log.warning("[eleven_webhook] ⚠️ Post-call descartado (%s): movido a %s", reason, qdir)
+    except OSError as e:
+        log.error("[eleven_webhook] ❌ No se pudo mover post-call a failed/ %s: %s", path, e)
+
+def _replay_post_call_spool():
+    try:
+        paths = sorted(list_json_files(POST_CALL_SPOOL_DIR))
+    except OSError:
+        return
+    now = time.time()
+    for path in paths:
+        with _POST_CALL_INFLIGHT_LOCK:
+            if path in _POST_CALL_INFLIGHT:
+                continue
+        try:
+            job = _read_json(path)
+            if job is None:
+                continue  # enviado (y borrado) entre el listado y la lectura
+            created = float(job.get("created") or os.path.getmtime(path))
+        except Exception as e:
+            log.warning("[eleven_webhook] ⚠️ Post-call pendiente ilegible %s: %s", path, e)
+            _quarantine_post_call(path, "ilegible")
+            continue
+        if now - created > POST_CALL_MAX_AGE_S:
+            _quarantine_post_call(path, "demasiado antiguo")
+            continue
+        _submit_post_call(job, path)
+
+# El spool se revisa desde las peticiones (no al importar: importar billing_api desde tests
+# o herramientas no debe enviar correos), como mucho una vez cada POST_CALL_REPLAY_EVERY_S
+_SPOOL_REPLAY = {"next": 0.0}
+_SPOOL_REPLAY_LOCK = threading.Lock()
+
+@billing_bp.before_app_request
+def _replay_post_call_spool_periodic():
+    now = time.monotonic()
+    if now < _SPOOL_REPLAY["next"]:
+        return
+    with _SPOOL_REPLAY_LOCK:
+        if now < _SPOOL_REPLAY["next"]:
+            return
+        _SPOOL_REPLAY["next"] = now + POST_CALL_REPLAY_EVERY_S
+    _replay_post_call_spool()
+
 @billing_bp.route("/webhooks/test-email", methods=["GET"])
 def test_email():
     ok = _send_email(
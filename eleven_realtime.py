@@ -4,16 +4,29 @@
 # Este archivo NO toca OpenAI ni tu /realtime/session existente.
 
 import os
+import time
+import threading
+from datetime import datetime
 import requests
-from flask import Blueprint, jsonify, request, make_response
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import Blueprint, jsonify, request
+from flask_cors import CORS
 try:
     # tu loader de bots (para mapear bot->agent_id si existe en JSON)
-    from utils.bot_loader import load_bot
+    from utils.bot_loader import cached_load_bot as load_bot
 except Exception:
     load_bot = None  # fallback suave
 
 bp = Blueprint("eleven_realtime", __name__, url_prefix="/eleven")
 
+# CORS del blueprint con Flask-CORS: refleja el Origin (send_wildcard=False) y responde
+# el preflight OPTIONS automático; el navegador lo cachea 24 h (max_age). Cualquier sitio
+# cliente que embebe el widget de ElevenLabs, como hacía _corsify; el after_request global
+# de main.py solo reescribe el header para ALLOWED_ORIGINS (mismo valor).
+CORS(bp, origins="*", methods=["GET", "POST", "OPTIONS"],
+     allow_headers=["Content-Type", "Authorization"], max_age=86400)
+
 # ===== ENV =====
 ELEVEN_API_KEY  = (os.getenv("ELEVENLABS_API_KEY") or "").strip()
 ELEVEN_AGENT_ID = (os.getenv("ELEVENLABS_AGENT_ID") or "").strip()
@@ -22,41 +35,68 @@ ELEVEN_AGENT_ID = (os.getenv("ELEVENLABS_AGENT_ID") or "").strip()
 ELEVEN_TOKEN_URL = "https://api.elevenlabs.io/v1/convai/token"
 ELEVEN_RTC_URL   = "https://api.elevenlabs.io/v1/convai/rtc"   # el browser hará POST SDP aquí
 
-def _corsify(resp):
-    """CORS básico por si tu after_request no atrapa OPTIONS en algún proxy."""
-    origin = request.headers.get("Origin", "")
-    if origin:
-        resp.headers["Access-Control-Allow-Origin"]  = origin
-        resp.headers["Vary"]                         = "Origin"
-        resp.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization"
-        resp.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
-        resp.headers["Access-Control-Max-Age"]       = "86400"
-    return resp
-
-@bp.route("/health", methods=["GET", "OPTIONS"])
+# ===== HTTP compartido hacia api.elevenlabs.io (keep-alive: sin TLS nuevo por sesión) =====
+_ELEVEN_HTTP = requests.Session()
+_ELEVEN_HTTP.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=32,
+                                           max_retries=Retry(total=1, backoff_factor=0.2)))
+
+# ===== Reutilizar token por agent_id hasta 10 s antes de expirar =====
+# Opt-in (ELEVEN_TOKEN_REUSE=1): solo sirve si la cuenta permite usar el mismo token en varias sesiones.
+ELEVEN_TOKEN_REUSE = (os.getenv("ELEVEN_TOKEN_REUSE") or "0").strip().lower() in ("1", "true", "yes", "on")
+_TOKEN_CACHE = {}  # agent_id -> (token, expires_at tal cual vino, expira epoch)
+_TOKEN_LOCK = threading.Lock()
+
+def _expires_epoch(expires_at):
+    """expires_at de Eleven (epoch s/ms o ISO-8601) -> epoch en segundos; None si no se entiende."""
+    if isinstance(expires_at, (int, float)) and not isinstance(expires_at, bool):
+        return expires_at / 1000.0 if expires_at > 1e12 else float(expires_at)
+    if isinstance(expires_at, str) and expires_at.strip():
+        try:
+            return datetime.fromisoformat(expires_at.strip().replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            return None
+    return None
+
+def _cached_token(agent_id):
+    hit = _TOKEN_CACHE.get(agent_id)
+    if hit and hit[2] - 10 > time.time():
+        return hit
+    return None
+
+def _remember_token(agent_id, token, expires_at):
+    exp = _expires_epoch(expires_at)
+    if exp is not None:
+        with _TOKEN_LOCK:
+            _TOKEN_CACHE[agent_id] = (token, expires_at, exp)
+
+def _session_payload(token, expires_at, agent_id):
+    return {
+        "ok": True,
+        "token": token,
+        "expires_at": expires_at,
+        "rtc_url": ELEVEN_RTC_URL,
+        "agent_id": agent_id
+    }
+
+@bp.route("/health", methods=["GET"])
 def health():
-    if request.method == "OPTIONS":
-        return _corsify(make_response(("", 204)))
     ok = bool(ELEVEN_API_KEY)
-    return _corsify(jsonify({
+    return jsonify({
         "ok": ok,
         "has_api_key": ok,
         "agent_default": ELEVEN_AGENT_ID or None,
         "rtc_url": ELEVEN_RTC_URL
-    }))
+    })
 
-@bp.route("/session", methods=["POST", "OPTIONS"])
+@bp.route("/session", methods=["POST"])
 def create_session():
     """
     Devuelve un token efímero para que el cliente WP negocie WebRTC con Eleven:
       - INPUT opcional: ?bot=<slug> (para mapear a agent_id por bot)
       - OUTPUT: { ok, token, expires_at, rtc_url, agent_id }
     """
-    if request.method == "OPTIONS":
-        return _corsify(make_response(("", 204)))
-
     if not ELEVEN_API_KEY:
-        return _corsify(jsonify({"ok": False, "error": "ELEVENLABS_API_KEY no configurada"})), 500
+        return jsonify({"ok": False, "error": "ELEVENLABS_API_KEY no configurada"}), 500
 
     # Elegir agent_id según el bot (si tu JSON lo trae), con fallback a ENV
     agent_id = ELEVEN_AGENT_ID or None
@@ -68,27 +108,28 @@ def create_session():
         except Exception:
             pass
 
+    if ELEVEN_TOKEN_REUSE:
+        hit = _cached_token(agent_id)
+        if hit:
+            return jsonify(_session_payload(hit[0], hit[1], agent_id))
+
     # Construye request al token endpoint de Eleven
     try:
         headers = {"xi-api-key": ELEVEN_API_KEY}
         payload = {}
         if agent_id:
             payload["agent_id"] = agent_id  # usa el Agent (ASR+LLM+TTS) de Eleven
-        r = requests.post(ELEVEN_TOKEN_URL, headers=headers, json=payload, timeout=15)
+        r = _ELEVEN_HTTP.post(ELEVEN_TOKEN_URL, headers=headers, json=payload, timeout=15)
         r.raise_for_status()
         data = r.json()  # esperado: { "token": "...", "expires_at": "..." }
 
         token = data.get("token")
         if not token:
-            return _corsify(jsonify({"ok": False, "error": "Eleven no devolvió token", "detail": data})), 502
-
-        return _corsify(jsonify({
-            "ok": True,
-            "token": token,
-            "expires_at": data.get("expires_at"),
-            "rtc_url": ELEVEN_RTC_URL,
-            "agent_id": agent_id
-        }))
+            return jsonify({"ok": False, "error": "Eleven no devolvió token", "detail": data}), 502
+
+        if ELEVEN_TOKEN_REUSE:
+            _remember_token(agent_id, token, data.get("expires_at"))
+        return jsonify(_session_payload(token, data.get("expires_at"), agent_id))
     except requests.HTTPError as e:
         try:
             status = r.status_code
@@ -96,6 +137,6 @@ def create_session():
         except Exception:
             status = 502
             detail = str(e)
-        return _corsify(jsonify({"ok": False, "error": "HTTP Eleven", "status": status, "detail": detail})), 502
+        return jsonify({"ok": False, "error": "HTTP Eleven", "status": status, "detail": detail}), 502
     except Exception as e:
-        return _corsify(jsonify({"ok": False, "error": "Excepción pidiendo token", "detail": str(e)})), 500
+        return jsonify({"ok": False, "error": "Excepción pidiendo token", "detail": str(e)}), 500
@@ -6,11 +6,16 @@
 from flask import Blueprint, request, jsonify
 from firebase_admin import db
 import requests
+from requests.adapters import HTTPAdapter
 import os
 from datetime import datetime
 
 ig_multi_bp = Blueprint("ig_multi_bp", __name__)
 
+# Conexión keep-alive hacia graph.facebook.com para el intercambio de code
+_HTTP = requests.Session()
+_HTTP.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=50))
+
 # ================================
 # 1. Intercambiar code por access_token
 # ================================
@@ -28,7 +33,7 @@ def api_instagram_exchange_code():
         return jsonify({"error": "Faltan parámetros code o redirect_uri"}), 400
 
     try:
-        resp = requests.post(
+        resp = _HTTP.post(
             "https://graph.facebook.com/v21.0/oauth/access_token",
             data={
                 "client_id": os.getenv("IG_CLIENT_ID"),
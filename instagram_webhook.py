@@ -6,9 +6,14 @@ import re
 import json
 import time
 import logging
+import queue
+import threading
 from datetime import datetime
-from collections import deque, defaultdict
+from collections import OrderedDict, defaultdict
+from functools import lru_cache
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from flask import Blueprint, request, jsonify, current_app
 
 logging.basicConfig(level=logging.INFO)
@@ -29,17 +34,43 @@ WP_IG_STATUS_URL = (os.getenv("WP_IG_STATUS_URL") or "").strip()
 IG_STATUS_TTL    = int(os.getenv("IG_STATUS_TTL", "20"))       # 20s por defecto
 IG_STATUS_DEFAULT_ON = (os.getenv("IG_STATUS_DEFAULT", "on").lower() in ("1","true","on","yes"))
 
+# ===== HTTP compartido (graph.facebook.com + WordPress) =====
+# Keep-alive: cada envío reutiliza la conexión TLS. Los reintentos por status no aplican a POST
+# (urllib3 solo reintenta métodos idempotentes), así que un mensaje nunca se manda dos veces.
+_HTTP = requests.Session()
+_HTTP.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=50,
+                                    max_retries=Retry(total=2, backoff_factor=0.1,
+                                                      status_forcelist=[502, 503, 504])))
+_IG_SEND_URL = f"https://graph.facebook.com/v21.0/{META_PAGE_ID}/messages"
+_IG_SEND_HEADERS = {
+    "Authorization": f"Bearer {META_PAGE_ACCESS_TOKEN}",
+    "Content-Type": "application/json"
+}
+
+# ===== Procesamiento de eventos =====
+IG_WORKERS   = max(1, int(os.getenv("IG_WORKERS", "8")))
+IG_QUEUE_MAX = int(os.getenv("IG_QUEUE_MAX", "1000"))   # tope total de conversaciones en espera
+
 # ===== Anti-duplicados =====
-_SEEN_MIDS = deque(maxlen=1000)
-_SEEN_SET  = set()
+# LRU de mids: un solo OrderedDict; un reintento de Meta refresca el mid en vez de dejarlo caducar
+_SEEN_MAX  = 1000
+_SEEN      = OrderedDict()
+_SEEN_LOCK = threading.Lock()
 def _seen_mid(mid: str) -> bool:
     if not mid: return False
-    if mid in _SEEN_SET: return True
-    _SEEN_SET.add(mid); _SEEN_MIDS.append(mid)
-    if len(_SEEN_SET) > _SEEN_MIDS.maxlen:
-        viejo = _SEEN_MIDS.popleft(); _SEEN_SET.discard(viejo)
+    with _SEEN_LOCK:
+        if mid in _SEEN:
+            _SEEN.move_to_end(mid)
+            return True
+        _SEEN[mid] = None
+        if len(_SEEN) > _SEEN_MAX:
+            _SEEN.popitem(last=False)
     return False
 
+def _forget_mid(mid: str):
+    with _SEEN_LOCK:
+        _SEEN.pop(mid, None)
+
 # ===== Estado de sesión IG =====
 IG_SESSION_HISTORY = defaultdict(list)
 IG_GREETED         = set()
@@ -48,8 +79,13 @@ def _clave_sesion(page_id: str, psid: str) -> str:
     return f"ig:{page_id}|{psid}"
 
 # ===== Helpers estilo =====
+# Patrones compilados al importar (corren en cada mensaje)
+_RE_SENT_SPLIT = re.compile(r'(?<=[.!?])\s+')
+_RE_WS         = re.compile(r"\s+")
+_RE_URL        = re.compile(r"https?://\S+")
+
 def _split_sentences(text: str):
-    parts = re.split(r'(?<=[\.\!\?])\s+', (text or "").strip())
+    parts = _RE_SENT_SPLIT.split((text or "").strip())
     if len(parts) == 1 and len(text or "") > 280:
         parts = [text[:200].strip(), text[200:].strip()]
     return [p for p in parts if p]
@@ -61,7 +97,7 @@ def _apply_style(bot_cfg: dict, text: str) -> str:
     max_sents = int(style.get("max_sentences", 2)) if style.get("max_sentences") is not None else 2
     if not short:
         return text
-    has_url = bool(re.search(r"https?://\S+", text))
+    has_url = bool(_RE_URL.search(text))
     if has_url:
         return text
     sents = _split_sentences(text)
@@ -77,7 +113,7 @@ def _next_probe_from_bot(bot_cfg: dict) -> str:
 
 def _ensure_question(bot_cfg: dict, text: str, force_question: bool) -> str:
     if not text: return text
-    txt = re.sub(r"\s+", " ", text).strip()
+    txt = _RE_WS.sub(" ", text).strip()
     if not force_question: return txt
     if "?" in txt: return txt
     if not txt.endswith((".", "!", "…")):
@@ -121,18 +157,46 @@ SCHEDULE_OFFER_PAT = re.compile(
 def _wants_link(text: str) -> bool:
     return bool(SCHEDULE_OFFER_PAT.search(text or ""))
 
+_DEFAULT_INTRO_KEYWORDS = ("hola","buenas","buenos dias","buenas tardes","buenas noches")
+
+@lru_cache(maxsize=256)
+def _intro_regex(keywords: tuple):
+    # Una alternación compilada por lista de keywords: una pasada sobre el texto en vez de
+    # un `k in low` por keyword. Sin \b: mismo match por subcadena que antes.
+    return re.compile("|".join(re.escape(k) for k in keywords))
+
+def _has_intro_keyword(low: str, keywords) -> bool:
+    kws = tuple(k for k in keywords if isinstance(k, str))
+    return bool(kws) and _intro_regex(kws).search(low) is not None
+
 # ===== Bot config lookup =====
-def _get_bot_cfg_for_page(page_id: str) -> dict:
+def _bot_index() -> dict:
+    """
+    page_id de Instagram -> cfg (gana el primer bot, como el recorrido lineal).
+    Se guarda en app.config junto al BOTS_CONFIG del que salió: si main.py lo
+    reemplaza por otro dict, el índice se rehace en el siguiente evento.
+    """
     bots = current_app.config.get("BOTS_CONFIG") or {}
-    for _, cfg in bots.items():
+    idx = current_app.config.get("BOTS_BY_IG_PAGE")
+    if idx is not None and idx["src"] is bots:
+        return idx
+    by_page = {}
+    for cfg in bots.values():
+        if not isinstance(cfg, dict):
+            continue
         ch = (cfg.get("channels") or {}).get("instagram") or {}
-        if (ch.get("page_id") or "").strip() == (page_id or "").strip():
-            return cfg
-    for _, cfg in bots.items():
-        ch = (cfg.get("channels") or {}).get("instagram") or {}
-        if (ch.get("page_id") or "").strip() == (META_PAGE_ID or "").strip():
-            return cfg
-    return list(bots.values())[0] if bots else {}
+        by_page.setdefault((ch.get("page_id") or "").strip(), cfg)
+    idx = {
+        "src": bots,
+        "by_page": by_page,
+        "fallback": by_page.get((META_PAGE_ID or "").strip()) or (next(iter(bots.values())) if bots else {}),
+    }
+    current_app.config["BOTS_BY_IG_PAGE"] = idx
+    return idx
+
+def _get_bot_cfg_for_page(page_id: str) -> dict:
+    idx = _bot_index()
+    return idx["by_page"].get((page_id or "").strip()) or idx["fallback"]
 
 # ===== Firebase append =====
 def _append_historial(bot_nombre: str, user_id: str, tipo: str, texto: str):
@@ -177,7 +241,7 @@ def _ig_is_enabled() -> bool:
         _IG_STATUS_CACHE.update({"ok": IG_STATUS_DEFAULT_ON, "ts": now})
         return IG_STATUS_DEFAULT_ON
     try:
-        r = requests.get(WP_IG_STATUS_URL, timeout=5)
+        r = _HTTP.get(WP_IG_STATUS_URL, timeout=5)
         if r.status_code == 200:
             data = r.json()
             ok = bool(data.get("enabled", True))
@@ -199,17 +263,12 @@ def _send_ig_text(psid: str, text: str) -> bool:
     if not META_PAGE_ACCESS_TOKEN or not META_PAGE_ID:
         logging.error("[IG] Faltan META_PAGE_ACCESS_TOKEN o META_PAGE_ID")
         return False
-    url = f"https://graph.facebook.com/v21.0/{META_PAGE_ID}/messages"
     payload = {
         "recipient": {"id": psid},
         "message": {"text": (text or "Gracias por escribirnos.")[:1000]}
     }
-    headers = {
-        "Authorization": f"Bearer {META_PAGE_ACCESS_TOKEN}",
-        "Content-Type": "application/json"
-    }
     try:
-        r = requests.post(url, headers=headers, json=payload, timeout=20)
+        r = _HTTP.post(_IG_SEND_URL, headers=_IG_SEND_HEADERS, json=payload, timeout=20)
         try: j = r.json()
         except Exception: j = {"_non_json": r.text}
         logging.info("[IG] SEND status=%s resp=%s", r.status_code, j)
@@ -230,6 +289,98 @@ def _ensure_plain_url(text: str) -> str:
     text = _MD_LINK.sub(_rep, text)
     return text
 
+def _handle_ig_message(page_id: str, psid: str, text: str):
+    """Responde un mensaje ya filtrado (con texto, no eco, mid nuevo). Corre en un worker."""
+    bot_cfg = _get_bot_cfg_for_page(page_id)
+    if not bot_cfg: return
+
+    system_prompt = (bot_cfg.get("system_prompt") or "").strip()
+    model_name    = (bot_cfg.get("model") or "gpt-4o").strip()
+    temperature   = float(bot_cfg.get("temperature", 0.6)) if isinstance(bot_cfg.get("temperature", None), (int,float)) else 0.6
+    ch_ig         = (bot_cfg.get("channels") or {}).get("instagram") or {}
+    intro_keywords = ch_ig.get("intro_keywords") or bot_cfg.get("intro_keywords") or _DEFAULT_INTRO_KEYWORDS
+
+    clave = _clave_sesion(page_id, psid)
+    if not IG_SESSION_HISTORY.get(clave):
+        IG_SESSION_HISTORY[clave] = [{"role":"system","content":system_prompt}] if system_prompt else []
+
+    low = text.lower()
+
+    # ✅ Solo saludo desde JSON y NO primera respuesta de OpenAI
+    saludo_json = ""  # inicializamos la variable
+
+    if (clave not in IG_GREETED) and _has_intro_keyword(low, intro_keywords):
+      saludo_json = ch_ig.get("intro_message") or bot_cfg.get("intro_message") or ""
+    if saludo_json:
+     _send_ig_text(psid, _apply_style(bot_cfg, saludo_json))
+     IG_GREETED.add(clave)
+     _append_historial(bot_cfg.get("name","BOT"), f"ig:{psid}", "bot", saludo_json)
+     return  # solo corta en el primer saludo
+
+
+    if _wants_link(text):
+        url = _effective_booking_url(bot_cfg)
+        if _valid_url(url):
+            msg = ch_ig.get("link_message") or (bot_cfg.get("agenda", {}) or {}).get("link_message") or "Aquí tienes el enlace:"
+            final = f"{msg.strip()} {url}".strip()
+            _send_ig_text(psid, final)
+            _append_historial(bot_cfg.get("name","BOT"), f"ig:{psid}", "bot", final)
+            return
+
+    IG_SESSION_HISTORY[clave].append({"role":"user","content":text})
+    _append_historial(bot_cfg.get("name","BOT"), f"ig:{psid}", "user", text)
+
+    if not _ig_is_enabled():
+        logging.info("[IG] Bot OFF tras revalidar — no se genera respuesta.")
+        return
+
+    respuesta = _gpt_reply(IG_SESSION_HISTORY[clave], model_name, temperature)
+    respuesta = _ensure_plain_url(respuesta)
+    respuesta = _apply_style(bot_cfg, respuesta)
+    must_ask = bool((bot_cfg.get("style") or {}).get("always_question", False))
+    respuesta = _ensure_question(bot_cfg, respuesta, force_question=must_ask)
+
+    if IG_SESSION_HISTORY[clave]:
+        last_assistant = next((m["content"] for m in reversed(IG_SESSION_HISTORY[clave]) if m["role"]=="assistant"), "")
+        if last_assistant and last_assistant.strip() == respuesta.strip():
+            probe = _next_probe_from_bot(bot_cfg)
+            if probe and probe not in respuesta:
+                if not respuesta.endswith((".", "!", "…", "¿", "?")):
+                    respuesta += "."
+                respuesta = f"{respuesta} {probe}".strip()
+
+    _send_ig_text(psid, respuesta)
+    IG_SESSION_HISTORY[clave].append({"role":"assistant","content":respuesta})
+    _append_historial(bot_cfg.get("name","BOT"), f"ig:{psid}", "bot", respuesta)
+
+# ===== Cola de eventos =====
+# Un Queue acotado por worker; la conversación (page_id, psid) siempre cae en el mismo
+# worker, así sus mensajes se responden en orden aunque lleguen en webhooks distintos.
+_IG_QUEUES = [queue.Queue(maxsize=max(1, IG_QUEUE_MAX // IG_WORKERS)) for _ in range(IG_WORKERS)]
+
+def _enqueue_ig(key, job) -> bool:
+    try:
+        _IG_QUEUES[hash(key) % IG_WORKERS].put_nowait(job)
+        return True
+    except queue.Full:
+        return False
+
+def _ig_worker(q):
+    while True:
+        app, items = q.get()
+        try:
+            with app.app_context():
+                for page_id, psid, txt, mid in items:
+                    try:
+                        _handle_ig_message(page_id, psid, txt)
+                    except Exception:
+                        logging.exception("[IG] Error procesando mensaje mid=%s", mid)
+        finally:
+            q.task_done()
+
+for _i, _q in enumerate(_IG_QUEUES):
+    threading.Thread(target=_ig_worker, args=(_q,), name=f"ig-worker-{_i}", daemon=True).start()
+
 # ===== Verificación =====
 @ig_bp.route("/webhook_instagram", methods=["GET"])
 def ig_verify():
@@ -266,99 +417,43 @@ def ig_events():
     if body.get("object") not in ("instagram","page"):
         return jsonify({"status":"ignored"}), 200
 
-    senders = []
-
-    def handle_one(page_id: str, psid: str, text: str, mid: str, is_echo: bool):
-        if not psid or not text: return
-        if is_echo or _seen_mid(mid): return
-
-        bot_cfg = _get_bot_cfg_for_page(page_id)
-        if not bot_cfg: return
-
-        system_prompt = (bot_cfg.get("system_prompt") or "").strip()
-        model_name    = (bot_cfg.get("model") or "gpt-4o").strip()
-        temperature   = float(bot_cfg.get("temperature", 0.6)) if isinstance(bot_cfg.get("temperature", None), (int,float)) else 0.6
-        ch_ig         = (bot_cfg.get("channels") or {}).get("instagram") or {}
-        intro_keywords = ch_ig.get("intro_keywords") or bot_cfg.get("intro_keywords") or ["hola","buenas","buenos dias","buenas tardes","buenas noches"]
-
-        clave = _clave_sesion(page_id, psid)
-        if not IG_SESSION_HISTORY.get(clave):
-            IG_SESSION_HISTORY[clave] = [{"role":"system","content":system_prompt}] if system_prompt else []
-
-        low = text.lower()
-
-        # ✅ Solo saludo desde JSON y NO primera respuesta de OpenAI
-        saludo_json = ""  # inicializamos la variable
-
-        if (clave not in IG_GREETED) and any(k in low for k in intro_keywords):
-          saludo_json = ch_ig.get("intro_message") or bot_cfg.get("intro_message") or ""
-        if saludo_json:
-         _send_ig_text(psid, _apply_style(bot_cfg, saludo_json))
-         IG_GREETED.add(clave)
-         _append_historial(bot_cfg.get("name","BOT"), f"ig:{psid}", "bot", saludo_json)
-         return  # solo corta en el primer saludo
-
-
-        if _wants_link(text):
-            url = _effective_booking_url(bot_cfg)
-            if _valid_url(url):
-                msg = ch_ig.get("link_message") or (bot_cfg.get("agenda", {}) or {}).get("link_message") or "Aquí tienes el enlace:"
-                final = f"{msg.strip()} {url}".strip()
-                _send_ig_text(psid, final)
-                _append_historial(bot_cfg.get("name","BOT"), f"ig:{psid}", "bot", final)
-                senders.append(psid)
-                return
-
-        IG_SESSION_HISTORY[clave].append({"role":"user","content":text})
-        _append_historial(bot_cfg.get("name","BOT"), f"ig:{psid}", "user", text)
-
-        if not _ig_is_enabled():
-            logging.info("[IG] Bot OFF tras revalidar — no se genera respuesta.")
+    # Eventos agrupados por conversación (page_id, psid), ya filtrados y deduplicados aquí:
+    # un mid repetido nunca llega a la cola
+    groups = {}
+    def collect(page_id, ev):
+        psid = ((ev.get("sender") or {}).get("id") or "").strip()
+        msg  = (ev.get("message") or {}) or {}
+        mid  = (msg.get("mid") or "").strip()
+        txt  = (msg.get("text") or "").strip()
+        if not psid or not txt or msg.get("is_echo") or _seen_mid(mid):
             return
-
-        respuesta = _gpt_reply(IG_SESSION_HISTORY[clave], model_name, temperature)
-        respuesta = _ensure_plain_url(respuesta)
-        respuesta = _apply_style(bot_cfg, respuesta)
-        must_ask = bool((bot_cfg.get("style") or {}).get("always_question", False))
-        respuesta = _ensure_question(bot_cfg, respuesta, force_question=must_ask)
-
-        if IG_SESSION_HISTORY[clave]:
-            last_assistant = next((m["content"] for m in reversed(IG_SESSION_HISTORY[clave]) if m["role"]=="assistant"), "")
-            if last_assistant and last_assistant.strip() == respuesta.strip():
-                probe = _next_probe_from_bot(bot_cfg)
-                if probe and probe not in respuesta:
-                    if not respuesta.endswith((".", "!", "…", "¿", "?")):
-                        respuesta += "."
-                    respuesta = f"{respuesta} {probe}".strip()
-
-        _send_ig_text(psid, respuesta)
-        IG_SESSION_HISTORY[clave].append({"role":"assistant","content":respuesta})
-        _append_historial(bot_cfg.get("name","BOT"), f"ig:{psid}", "bot", respuesta)
-        senders.append(psid)
+        groups.setdefault((page_id, psid), []).append((page_id, psid, txt, mid))
 
     for entry in (body.get("entry") or []):
         page_id = entry.get("id") or META_PAGE_ID
         for change in (entry.get("changes") or []):
             for ev in (change.get("value",{}).get("messaging") or []):
-                psid = ((ev.get("sender") or {}).get("id") or "").strip()
-                msg  = (ev.get("message") or {}) or {}
-                mid  = (msg.get("mid") or "").strip()
-                txt  = (msg.get("text") or "").strip()
-                is_echo = bool(msg.get("is_echo"))
-                handle_one(page_id, psid, txt, mid, is_echo)
+                collect(page_id, ev)
 
     for entry in (body.get("entry") or []):
         page_id = entry.get("id") or META_PAGE_ID
         for ev in (entry.get("messaging") or []):
-            psid = ((ev.get("sender") or {}).get("id") or "").strip()
-            msg  = (ev.get("message") or {}) or {}
-            mid  = (msg.get("mid") or "").strip()
-            txt  = (msg.get("text") or "").strip()
-            is_echo = bool(msg.get("is_echo"))
-            handle_one(page_id, psid, txt, mid, is_echo)
-
-    logging.info("WEBHOOK IG SENDER_IDS: %s", senders)
-    return jsonify({"status":"ok","senders":senders}), 200
+            collect(page_id, ev)
+
+    # 200 inmediato: GPT + envío Graph + Firebase corren en los workers
+    app = current_app._get_current_object()
+    dropped = 0
+    for key, items in groups.items():
+        if not _enqueue_ig(key, (app, items)):
+            dropped += 1
+            for it in items:
+                _forget_mid(it[3])  # que el reintento de Meta no se tome como duplicado
+    if dropped:
+        logging.warning("[IG] Cola llena: %d conversación(es) sin encolar, se pide reintento", dropped)
+        return jsonify({"status":"busy"}), 503
+
+    logging.info("WEBHOOK IG encolados: %s", [k[1] for k in groups])
+    return jsonify({"status":"queued","queued":len(groups)}), 200
 
 # ===== NUEVO: Endpoint para intercambiar "code" -> access_token =====
 @ig_bp.route("/ig_exchange_token", methods=["GET"])
@@ -374,7 +469,7 @@ def ig_exchange_token():
             "redirect_uri": REDIRECT_URI,
             "code": code,
         }
-        r = requests.get(url, params=params, timeout=20)
+        r = _HTTP.get(url, params=params, timeout=20)
         data = r.json()
         return jsonify(data), r.status_code
     except Exception as e:
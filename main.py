@@ -23,14 +23,16 @@ from datetime import datetime, timedelta
 import csv
 from io import StringIO
 import re
-import glob
 import random
 import hashlib
 import html
 import uuid
 import requests
+import orjson
+from utils.bot_loader import list_json_files
+from utils.phone_utils import canonize_phone
+from flask.json.provider import DefaultJSONProvider
 from eleven_realtime import bp as eleven_rt_bp
-from routes.eleven_session import bp as eleven_bp
 from routes.eleven_webrtc import bp as eleven_webrtc_bp
 
 
@@ -46,6 +48,21 @@ from firebase_admin import messaging as fcm
 # ✅ Crear la app ANTES de registrar los blueprints (y solo una vez)
 app = Flask(__name__)
 
+# 🔹 jsonify / request.get_json con orjson (mismo contrato que el provider por defecto)
+class OrjsonProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME  # fechas como Flask (http_date)
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+app.json = OrjsonProvider(app)
+
 # 🔹 Avatar Realtime (sesión efímera para “Hablar ahora”)
 from avatar_realtime import bp as realtime_bp
 from avatar_profiles import bp as profiles_bp
@@ -60,7 +77,6 @@ app.register_blueprint(realtime_bp)
 app.register_blueprint(profiles_bp)
 app.register_blueprint(voice_rt_bp)
 app.register_blueprint(eleven_rt_bp)
-app.register_blueprint(eleven_bp)
 app.register_blueprint(eleven_webrtc_bp)
 
 from routes.send_link import bp as send_link_bp
@@ -207,7 +223,12 @@ else:
 # =======================
 def load_bots_folder():
     bots = {}
-    for path in glob.glob(os.path.join("bots", "*.json")):
+    try:
+        paths = list_json_files("bots")
+    except OSError as e:
+        print(f"⚠️ No se pudo listar ./bots: {e}")
+        return bots
+    for path in paths:
         try:
             with open(path, "r", encoding="utf-8") as f:
                 data = json.load(f)
@@ -222,6 +243,15 @@ bots_config = load_bots_folder()
 if not bots_config:
     print("⚠️ No se encontraron bots en ./bots/*.json")
 
+# Nombres normalizados una sola vez (bots_config no cambia en caliente); gana el primero,
+# igual que los recorridos lineales que reemplazan
+_BOTS_BY_LNAME = {}      # name.lower() -> cfg
+_BOT_KEY_BY_SLNAME = {}  # name.strip().lower() -> clave "whatsapp:+1..."
+for _key, _cfg in bots_config.items():
+    if isinstance(_cfg, dict):
+        _BOTS_BY_LNAME.setdefault(str(_cfg.get("name", "")).lower(), _cfg)
+        _BOT_KEY_BY_SLNAME.setdefault(str(_cfg.get("name", "")).strip().lower(), _key)
+
 # =======================
 #  💡 Registrar la API de facturación (Blueprint)
 # =======================
@@ -270,38 +300,17 @@ def _hora_to_epoch_ms(hora_str: str) -> int:
         return 0
 
 def _normalize_bot_name(name: str):
-    for cfg in bots_config.values():
-        if isinstance(cfg, dict):
-            if cfg.get("name", "").lower() == str(name).lower():
-                return cfg.get("name")
-    return None
+    cfg = _BOTS_BY_LNAME.get(str(name).lower())
+    return cfg.get("name") if cfg is not None else None
 
 def _get_bot_cfg_by_name(name: str):
     if not name:
         return None
-    for cfg in bots_config.values():
-        if isinstance(cfg, dict) and cfg.get("name", "").lower() == name.lower():
-            return cfg
-    return None
+    return _BOTS_BY_LNAME.get(name.lower())
 
 def _get_bot_cfg_by_number(to_number: str):
     return bots_config.get(to_number)
 
-# ✅ VOICE helper: canonizar número a E.164 (+1...)
-def _canonize_phone(raw: str) -> str:
-    s = str(raw or "").strip()
-    for p in ("whatsapp:", "tel:", "sip:", "client:"):
-        if s.startswith(p):
-            s = s[len(p):]
-    digits = "".join(ch for ch in s if ch.isdigit())
-    if not digits:
-        return ""
-    if len(digits) == 11 and digits.startswith("1"):
-        return "+" + digits
-    if len(digits) == 10:
-        digits = "1" + digits
-    return "+" + digits
-
 # ✅ VOICE helper: encuentra bot por número (E.164 o whatsapp:+)
 def _get_bot_cfg_by_any_number(to_number: str):
     if not to_number:
@@ -309,9 +318,9 @@ def _get_bot_cfg_by_any_number(to_number: str):
             return list(bots_config.values())[0]
     
     # ✅ CORRECCIÓN FINAL: Buscar por E.164 para mayor compatibilidad
-    canon_to = _canonize_phone(to_number)
+    canon_to = canonize_phone(to_number)
     for key, cfg in bots_config.items():
-        if _canonize_phone(key) == canon_to:
+        if canonize_phone(key) == canon_to:
             return cfg
     
     return bots_config.get(to_number)
@@ -319,13 +328,12 @@ def _get_bot_cfg_by_any_number(to_number: str):
 
 def _get_bot_number_by_name(bot_name: str) -> str:
     """Devuelve la clave 'whatsapp:+1...' de bots_config para un nombre de bot dado."""
-    for number_key, cfg in bots_config.items():
-        if isinstance(cfg, dict) and cfg.get("name", "").strip().lower() == (bot_name or "").strip().lower():
-            return number_key
-    return ""
+    return _BOT_KEY_BY_SLNAME.get((bot_name or "").strip().lower(), "")
+
+_SENT_SPLIT_RE = re.compile(r'(?<=[.!?])\s+')
 
 def _split_sentences(text: str):
-    parts = re.split(r'(?<=[\.\!\?])\s+', (text or "").strip())
+    parts = _SENT_SPLIT_RE.split((text or "").strip())
     if len(parts) == 1 and len(text or "") > 280:
         parts = [text[:200].strip(), text[200:].strip()]
     return [p for p in parts if p]
@@ -350,7 +358,7 @@ def _next_probe_from_bot(bot_cfg: dict) -> str:
     return random.choice(probes)
 
 def _ensure_question(bot_cfg: dict, text: str, force_question: bool) -> str:
-    txt = re.sub(r"\s+", " ", (text or "")).strip()
+    txt = _WS_RE.sub(" ", (text or "")).strip()
     if not force_question:
         return txt
     if "?" in txt:
@@ -416,41 +424,51 @@ SCHEDULE_OFFER_PAT = re.compile(
 def _wants_link(text: str) -> bool:
     return bool(SCHEDULE_OFFER_PAT.search(text or ""))
 
+_APP_WORDS = ("app", "aplicación", "aplicacion", "ios", "android", "play store", "app store")
+_DOWNLOAD_WORDS = ("descargar", "download", "bajar", "instalar", "link", "enlace")
+
 def _wants_app_download(text: str) -> bool:
     t = (text or "").lower()
-    has_app_word = any(w in t for w in ["app", "aplicación", "aplicacion", "ios", "android", "play store", "app store"])
-    has_download_intent = any(w in t for w in ["descargar", "download", "bajar", "instalar", "link", "enlace"])
+    has_app_word = any(w in t for w in _APP_WORDS)
+    has_download_intent = any(w in t for w in _DOWNLOAD_WORDS)
     return ("descargar app" in t) or ("download app" in t) or (has_app_word and has_download_intent)
 
+# Vocabularios de intención: se arman una vez al importar (frase exacta o frase + " ..." al inicio)
+_AFIRM = frozenset({"si","sí","ok","okay","dale","va","claro","por favor","hagamoslo","hagámoslo","perfecto","de una","yes","yep","yeah","sure","please"})
+_AFIRM_PREFIXES = tuple(a + " " for a in _AFIRM)
+_NEGATIVES = frozenset({"no", "nop", "no gracias", "ahora no", "luego", "después", "despues", "not now"})
+_SCHEDULED_KWS = ("ya agende","ya agendé","agende","agendé","ya programe","ya programé","ya agendado","agendado","confirmé","confirmado","listo","done","booked","i booked","i scheduled","scheduled")
+_CIERRES = frozenset({"gracias","muchas gracias","ok gracias","listo gracias","perfecto gracias","estamos en contacto","por ahora está bien","por ahora esta bien","luego te escribo","luego hablamos","hasta luego","buen día","buen dia","buenas noches","nos vemos","chao","bye","eso es todo","todo bien gracias"})
+_CIERRES_PREFIXES = tuple(c + " " for c in _CIERRES)
+_WS_RE = re.compile(r"\s+")
+_TAIL_PUNCT_RE = re.compile(r"[.,;:!?]+$")
+
 def _is_affirmative(texto: str) -> bool:
     if not texto: return False
     t = texto.strip().lower()
-    afirm = {"si","sí","ok","okay","dale","va","claro","por favor","hagamoslo","hagámoslo","perfecto","de una","yes","yep","yeah","sure","please"}
-    return any(t == a or t.startswith(a + " ") for a in afirm)
+    return t in _AFIRM or t.startswith(_AFIRM_PREFIXES)
 
 def _is_negative(texto: str) -> bool:
     if not texto: return False
-    t = re.sub(r'[.,;:!?]+$', '', texto.strip().lower())
-    t = re.sub(r'\s+', ' ', t)
-    negatives = {"no", "nop", "no gracias", "ahora no", "luego", "después", "despues", "not now"}
-    return t in negatives
+    t = _TAIL_PUNCT_RE.sub('', texto.strip().lower())
+    t = _WS_RE.sub(' ', t)
+    return t in _NEGATIVES
 
 def _is_scheduled_confirmation(texto: str) -> bool:
     if not texto: return False
     t = texto.lower()
-    kws = ["ya agende","ya agendé","agende","agendé","ya programe","ya programé","ya agendado","agendado","confirmé","confirmado","listo","done","booked","i booked","i scheduled","scheduled"]
-    return any(k in t for k in kws)
+    return any(k in t for k in _SCHEDULED_KWS)
 
 def _is_polite_closure(texto: str) -> bool:
     if not texto: return False
     t = texto.strip().lower()
-    cierres = {"gracias","muchas gracias","ok gracias","listo gracias","perfecto gracias","estamos en contacto","por ahora está bien","por ahora esta bien","luego te escribo","luego hablamos","hasta luego","buen día","buen dia","buenas noches","nos vemos","chao","bye","eso es todo","todo bien gracias"}
-    return any(t == c or t.startswith(c + " ") for c in cierres)
+    return t in _CIERRES or t.startswith(_CIERRES_PREFIXES)
 
 def _now(): return int(time.time())
 def _minutes_since(ts): return (_now() - int(ts or 0)) / 60.0
 def _hash_text(s: str) -> str:
-    return hashlib.md5((s or "").strip().lower().encode("utf-8")).hexdigest()
+    # Solo deduplica respuestas en agenda_state (memoria): blake2b-128 es más rápido que md5
+    return hashlib.blake2b((s or "").strip().lower().encode("utf-8"), digest_size=16).hexdigest()
 
 def _get_agenda(clave):
     return agenda_state.get(clave) or {"awaiting_confirm": False, "status": "none", "last_update": 0, "last_link_time": 0, "last_bot_hash": "", "closed": False}
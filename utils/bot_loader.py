@@ -2,8 +2,8 @@
 # Cargador de configuración de “tarjeta inteligente” por cliente (JSON)
 import json
 import os
-import glob
-from typing import Any, Dict, Optional
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))   # .../multi-bot-inteligente/utils
 PROJECT_ROOT = os.path.dirname(BASE_DIR)                # .../multi-bot-inteligente
@@ -20,6 +20,19 @@ def _safe_join(*parts: str) -> str:
     path = os.path.join(*parts)
     return os.path.normpath(path)
 
+def list_json_entries(folder: str) -> list:
+    """
+    DirEntry de los *.json (no ocultos) de una carpeta. Un solo scandir con is_file()
+    cacheado; OSError si la carpeta no existe.
+    """
+    with os.scandir(folder) as it:
+        return [e for e in it
+                if e.name.endswith(".json") and not e.name.startswith(".") and e.is_file()]
+
+def list_json_files(folder: str) -> list:
+    """Igual que list_json_entries pero solo las rutas."""
+    return [e.path for e in list_json_entries(folder)]
+
 # ─────────────────────────────────────────────────────────────
 # Normalización de identificadores (número/slug)
 # ─────────────────────────────────────────────────────────────
@@ -117,7 +130,11 @@ def _search_in_bundles(bot_id: str) -> Optional[Dict[str, Any]]:
     con una clave igual a alguna variante del bot_id, devuelve ese sub-dict.
     """
     keys = _normalize_keys(bot_id)
-    for path in glob.glob(os.path.join(BOTS_DIR, "*.json")):
+    try:
+        paths = list_json_files(BOTS_DIR)
+    except OSError:
+        return None
+    for path in paths:
         try:
             with open(path, "r", encoding="utf-8") as f:
                 data = json.load(f)
@@ -178,3 +195,46 @@ def load_bot(bot_id: str) -> Dict[str, Any]:
             data["whatsapp_number"] = wa
 
     return data
+
+def system_prompt_of(bot_cfg: Dict[str, Any]) -> str:
+    """
+    System prompt del bot en cualquiera de los formatos de JSON soportados:
+    - { instructions: { system_prompt: "..." } }
+    - { system_prompt: "..." }
+    - { prompt: "..." }
+    """
+    if not isinstance(bot_cfg, dict):
+        return ""
+    ins = bot_cfg.get("instructions") or {}
+    if isinstance(ins, dict) and ins.get("system_prompt"):
+        return str(ins["system_prompt"])
+    if bot_cfg.get("system_prompt"):
+        return str(bot_cfg["system_prompt"])
+    if bot_cfg.get("prompt"):
+        return str(bot_cfg["prompt"])
+    return ""
+
+# ─────────────────────────────────────────────────────────────
+# Carga con caché (hot paths: /realtime/session, /eleven/session)
+# ─────────────────────────────────────────────────────────────
+@lru_cache(maxsize=64)
+def _load_bot_at(bot_id: str, mtime_ns: int) -> Dict[str, Any]:
+    # mtime_ns solo forma parte de la clave: si el archivo cambia, es otra entrada
+    return load_bot(bot_id)
+
+def load_bot_versioned(bot_id: str) -> Tuple[Optional[int], Dict[str, Any]]:
+    """
+    Como load_bot(), pero memoizado por (bot_id, mtime del JSON directo):
+    en un hit solo cuesta resolver la ruta + un stat.
+    Devuelve (mtime_ns, cfg); mtime_ns es None si el bot sale de un bundle,
+    que se carga sin caché. El dict devuelto es compartido: no mutarlo.
+    """
+    try:
+        mtime_ns = os.stat(resolve_bot_path(bot_id)).st_mtime_ns
+    except (BotConfigNotFound, OSError):
+        return None, load_bot(bot_id)
+    return mtime_ns, _load_bot_at(bot_id, mtime_ns)
+
+def cached_load_bot(bot_id: str) -> Dict[str, Any]:
+    """load_bot() con caché por mtime (ver load_bot_versioned). No mutar el resultado."""
+    return load_bot_versioned(bot_id)[1]
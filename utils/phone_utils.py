@@ -0,0 +1,19 @@
+# utils/phone_utils.py
+# Normalización de números de teléfono compartida por main.py y los blueprints de voz
+import re
+
+# Prefijos de canal (en este orden, cada uno a lo sumo una vez) y todo lo que no sea dígito
+_PHONE_PREFIX_RE = re.compile(r"^(?:whatsapp:)?(?:tel:)?(?:sip:)?(?:client:)?")
+_NON_DIGIT_RE = re.compile(r"\D+")
+
+def canonize_phone(raw: str) -> str:
+    """Canoniza un número a E.164 (+1...): quita prefijos de canal y asume US con 10 dígitos."""
+    s = _PHONE_PREFIX_RE.sub("", str(raw or "").strip(), count=1)
+    digits = _NON_DIGIT_RE.sub("", s)
+    if not digits:
+        return ""
+    if len(digits) == 11 and digits.startswith("1"):
+        return "+" + digits
+    if len(digits) == 10:
+        digits = "1" + digits
+    return "+" + digits
@@ -1,44 +1,52 @@
 # voice_realtime.py
 import os
-import glob
-import json
 import httpx
+import orjson
 from flask import Blueprint, request, Response, send_from_directory
 from twilio.twiml.voice_response import VoiceResponse, Gather
+from utils.bot_loader import list_json_files, system_prompt_of
+from utils.phone_utils import canonize_phone
 
 bp = Blueprint("voice_realtime", __name__, url_prefix="/voice-realtime")
 
 # Carpeta temporal para audios
 TMP_DIR = "/tmp"
 
+# Cliente HTTP/2 compartido hacia api.openai.com: chat + TTS de cada turno
+# multiplexan sobre la misma conexión TLS en vez de abrir dos por request.
+_OPENAI_HTTP = httpx.Client(
+    http2=True,
+    timeout=httpx.Timeout(60.0, connect=3.0),
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+)
+
+def _openai_key_ready() -> bool:
+    """
+    Fija el Authorization en _OPENAI_HTTP la primera vez que hay OPENAI_API_KEY.
+    No se lee al importar: main.py hace load_dotenv() después de importar este blueprint.
+    """
+    if "Authorization" in _OPENAI_HTTP.headers:
+        return True
+    key = (os.getenv("OPENAI_API_KEY") or "").strip()
+    if not key:
+        return False
+    _OPENAI_HTTP.headers["Authorization"] = f"Bearer {key}"
+    return True
+
 # ──────────────────────────────────────────────
 # Helpers: resolver bot por número EXCLUSIVAMENTE desde bots/*.json
 # ──────────────────────────────────────────────
 
-def _canonize_phone(raw: str) -> str:
-    s = str(raw or "").strip()
-    for p in ("whatsapp:", "tel:", "sip:", "client:"):
-        if s.startswith(p):
-            s = s[len(p):]
-    digits = "".join(ch for ch in s if ch.isdigit())
-    if not digits:
-        return ""
-    if len(digits) == 11 and digits.startswith("1"):
-        return "+" + digits
-    if len(digits) == 10:
-        digits = "1" + digits
-    return "+" + digits
-
 def _load_bot_cfg_by_number_only_bots_folder(to_number: str):
     """
     Busca en bots/*.json una entrada que corresponda al número.
     NUNCA lee tarjeta_inteligente.
     """
-    canon_to = _canonize_phone(to_number)  # ej: +18326213202
+    canon_to = canonize_phone(to_number)  # ej: +18326213202
     try:
-        for path in glob.glob(os.path.join("bots", "*.json")):
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
+        for path in list_json_files("bots"):
+            with open(path, "rb") as f:
+                data = orjson.loads(f.read())
             if not isinstance(data, dict):
                 continue
 
@@ -46,7 +54,7 @@ def _load_bot_cfg_by_number_only_bots_folder(to_number: str):
             for key, cfg in data.items():
                 if not isinstance(cfg, dict):
                     continue
-                if _canonize_phone(key) == canon_to:
+                if canonize_phone(key) == canon_to:
                     return cfg
 
             # 2) channels.whatsapp.number o whatsapp_number dentro del objeto
@@ -56,24 +64,12 @@ def _load_bot_cfg_by_number_only_bots_folder(to_number: str):
                 ch = cfg.get("channels") or {}
                 wa = ch.get("whatsapp") or {}
                 num = wa.get("number") or cfg.get("whatsapp_number") or ""
-                if _canonize_phone(num) == canon_to:
+                if canonize_phone(num) == canon_to:
                     return cfg
     except Exception:
         pass
     return None
 
-def _effective_system_prompt(bot_cfg: dict) -> str:
-    if not isinstance(bot_cfg, dict):
-        return ""
-    ins = bot_cfg.get("instructions") or {}
-    if isinstance(ins, dict) and ins.get("system_prompt"):
-        return str(ins["system_prompt"])
-    if bot_cfg.get("system_prompt"):
-        return str(bot_cfg["system_prompt"])
-    if bot_cfg.get("prompt"):
-        return str(bot_cfg["prompt"])
-    return ""
-
 def _effective_greeting(bot_cfg: dict) -> str:
     if not isinstance(bot_cfg, dict):
         return "Hola, gracias por llamar. ¿En qué puedo ayudarle hoy?"
@@ -138,41 +134,37 @@ def handle_response():
     user_speech = request.values.get("SpeechResult", "")
 
     bot_cfg = _load_bot_cfg_by_number_only_bots_folder(to_number)
-    if not bot_cfg:
+    if not bot_cfg or not _openai_key_ready():
         resp = VoiceResponse()
         resp.say("Lo siento, hubo un problema técnico.")
         return Response(str(resp), mimetype="text/xml")
 
-    system_prompt = _effective_system_prompt(bot_cfg) or "Eres un asistente en español."
+    system_prompt = system_prompt_of(bot_cfg) or "Eres un asistente en español."
     model = _effective_model_text(bot_cfg)  # texto
     voice = _effective_voice(bot_cfg)       # p. ej. "cedar"
 
-    headers = {"Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}"}
-
     # 1) Respuesta en texto del modelo
-    with httpx.Client(timeout=30.0) as client:
-        r = client.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json={
-                "model": model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_speech}
-                ]
-            }
-        )
-        r.raise_for_status()
-        text_reply = r.json()["choices"][0]["message"]["content"]
+    r = _OPENAI_HTTP.post(
+        "https://api.openai.com/v1/chat/completions",
+        json={
+            "model": model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_speech}
+            ]
+        },
+        timeout=httpx.Timeout(30.0, connect=3.0),
+    )
+    r.raise_for_status()
+    text_reply = r.json()["choices"][0]["message"]["content"]
 
     # 2) TTS en la voz definida por el bot (cedar, etc.)
-    with httpx.Client(timeout=60.0) as client:
-        r2 = client.post(
-            "https://api.openai.com/v1/audio/speech",
-            headers=headers,
-            json={"model": "gpt-4o-mini-tts", "voice": voice, "input": text_reply}
-        )
-        r2.raise_for_status()
+    r2 = _OPENAI_HTTP.post(
+        "https://api.openai.com/v1/audio/speech",
+        json={"model": "gpt-4o-mini-tts", "voice": voice, "input": text_reply},
+        timeout=httpx.Timeout(60.0, connect=3.0),
+    )
+    r2.raise_for_status()
 
     # Guardar temporalmente el audio
     os.makedirs(TMP_DIR, exist_ok=True)
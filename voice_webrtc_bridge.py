@@ -8,6 +8,7 @@ from twilio.twiml.voice_response import VoiceResponse
 import websocket
 from threading import Thread
 from urllib.parse import urlencode
+from utils.phone_utils import canonize_phone
 
 try:
     import numpy as np
@@ -17,20 +18,10 @@ except Exception as e:
 bp = Blueprint("voice_webrtc", __name__, url_prefix="/voice-webrtc")
 
 # ---------- Utils ----------
-def _canonize_phone(raw: str) -> str:
-    s = str(raw or "").strip()
-    for p in ("whatsapp:", "tel:", "sip:", "client:"):
-        if s.startswith(p): s = s[len(p):]
-    digits = "".join(ch for ch in s if ch.isdigit())
-    if not digits: return ""
-    if len(digits) == 11 and digits.startswith("1"): return "+" + digits
-    if len(digits) == 10: digits = "1" + digits
-    return "+" + digits
-
 def _get_bot_cfg_by_any_number(bots_config: dict, to_number: str):
-    canon = _canonize_phone(to_number)
+    canon = canonize_phone(to_number)
     for k, cfg in (bots_config or {}).items():
-        if _canonize_phone(k) == canon:
+        if canonize_phone(k) == canon:
             return cfg
     return (bots_config or {}).get(to_number)
 
@@ -94,7 +85,7 @@ def _pcm16_bytes_rms_norm_0_1(pcm16_bytes: bytes) -> float:
     if arr.size == 0: return 0.0
     arr /= 32768.0
     rms = float(np.sqrt(np.mean(arr * arr)))
-    return max(0.0, min(1.0, rms))
+    return rms if 0.0 <= rms <= 1.0 else (0.0 if rms < 0.0 else 1.0)
 
 # ---------- OpenAI Realtime WS ----------
 def _openai_ws_connect(model: str, instructions: str, voice: str, debug=False):
@@ -132,7 +123,7 @@ def _openai_ws_connect(model: str, instructions: str, voice: str, debug=False):
 @bp.route("/call", methods=["POST"])
 def call_entry():
     to_number_raw = request.values.get("To", "")
-    to_number = _canonize_phone(to_number_raw)
+    to_number = canonize_phone(to_number_raw)
     resp = VoiceResponse()
     ws_base = request.url_root.replace("http", "ws").rstrip("/") + "/voice-webrtc/stream"
     qs = urlencode({"to": to_number})